@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+"""
+Compare DeFramed's frame compression modes.
+
+For each mode, print the average bytes per frame and the CPU time per
+frame. "pmd" simulates permessage-deflate with context takeover, i.e.
+one zlib stream per websocket.
+"""
+
+import sys
+import time
+import zlib
+import random
+
+from deframed.util import packer
+from deframed.compress import FrameCompressor, train_dictionary, SAMPLES
+
+
+def remi_cell(x, y):
+    wid = random.randrange(10**14, 10**15)
+    img = random.choice(["", "url('/res:flag.png')", "url('/res:mine.png')"])
+    return ('<td id="%d" class="TableItem" style="width:30px;height:30px;'
+            'font-weight:bold;text-align:center;background-size:contain;'
+            'background-color:rgb(255,255,255);background-image:%s" '
+            'onclick="remi.sendCallback(\'%d\',\'onclick\');event.stopPropagation();event.preventDefault();" '
+            'data-parent-widget="%d">%s</td>') % (wid, img, wid, wid, random.choice(["", "1", "2", "3"]))
+
+def bootstrap_row(i):
+    return ('<tr><td>%d</td><td><button type="button" class="btn btn-primary" id="b%d">Edit</button></td>'
+            '<td><span class="badge badge-secondary">%s</span></td></tr>') % (i, i, random.choice(["new","old","done"]))
+
+def frames(n):
+    for i in range(n):
+        r = random.random()
+        if r < 0.6:
+            yield packer(["elem", ["c%d" % i, remi_cell(i%30, i//30)]])
+        elif r < 0.9:
+            yield packer(["set", ["tbl", "".join(bootstrap_row(j) for j in range(random.randrange(1,20))), None]])
+        else:
+            yield packer(["info", dict(level="info", text="Step %d done" % i, timeout=2)])
+
+
+def bench(name, fn, data):
+    t = time.process_time()
+    n = 0
+    for msg in data:
+        n += len(fn(msg))
+    t = time.process_time() - t
+    print("%-12s %8.1f bytes/frame %8.2f µs/frame" % (name, n/len(data), t*1e6/len(data)))
+
+
+def main(n=2000):
+    random.seed(42)
+    data = list(frames(n))
+    zdict = train_dictionary(SAMPLES + [remi_cell(0,0) for _ in range(10)] + [bootstrap_row(0) for _ in range(10)])
+
+    bench("raw", lambda m: m, data)
+
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    bench("pmd", lambda m: c.compress(m)+c.flush(zlib.Z_SYNC_FLUSH), data)
+
+    for mode in ("deflate", "dict"):
+        fc = FrameCompressor(mode, zdict, 0)
+        bench(mode, fc.compress, data)
+        fc = FrameCompressor(mode, zdict, 128)
+        bench(mode+">128", fc.compress, data)
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -1,5 +1,5 @@
 from .server import App
-from .worker import Worker
+from .worker import Worker, PackedMessage, on_msg, on_button, on_form
 
 from importlib.metadata import version as _version, PackageNotFoundError
 try:
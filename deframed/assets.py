@@ -0,0 +1,348 @@
+"""
+This module contains DeFramed's in-memory static file server.
+
+All files are read (or, if large, mapped) when the server starts. Gzip and
+(if available) Brotli variants of compressible files are computed once.
+Serving a file thus never touches the disk.
+"""
+
+import os
+import re
+import gzip
+import mmap
+import mimetypes
+from datetime import timezone
+from hashlib import sha1
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Dict, List
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from rjsmin import jsmin
+except ImportError:
+    jsmin = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ["StaticFiles", "Asset"]
+
+_COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml|x-javascript)|image/svg)")
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{8,}\.[^./]+$")
+_SOURCEMAP = re.compile(rb"^//[#@] sourceMappingURL=.*$", re.M)
+
+# preferred order if the client accepts more than one encoding equally
+_ENCODINGS = ("br", "gzip")
+
+
+def accepted_encodings(hdr: Optional[str]) -> Dict[str,float]:
+    """
+    Parse an ``Accept-Encoding`` header into a dict of encoding → quality.
+    """
+    res = {}
+    if not hdr:
+        return res
+    for part in hdr.split(","):
+        enc, *params = part.strip().split(";")
+        q = 1.0
+        for p in params:
+            p = p.strip()
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        res[enc.strip().lower()] = q
+    return res
+
+
+def parse_etags(hdr: Optional[str]):
+    """
+    Split an ``If-None-Match`` header into a set of ETags.
+    Weak tags are returned as their strong equivalent.
+    """
+    if not hdr:
+        return ()
+    res = set()
+    for tag in hdr.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        res.add(tag)
+    return res
+
+
+class _Chunks:
+    """
+    Streams a large mmapped file without copying all of it.
+
+    Not a generator: Quart would iterate that in a thread.
+    """
+    size = 65536
+
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view)
+
+    def __iter__(self):
+        v = self.view
+        for i in range(0, len(v), self.size):
+            yield bytes(v[i:i+self.size])
+
+
+class Asset:
+    """
+    A single static file, plus its compressed variants.
+
+    Pass either the path of a file or its content.
+
+    Statistics are collected in ``hits`` (a dict of encoding → count),
+    ``not_modified``, and ``bytes_sent``.
+    """
+    _mmap = None
+    _data = None
+    mtime = None
+    last_modified = None
+
+    def __init__(self, name: str, cfg, path: str = None, data: bytes = None):
+        self.path = path
+        self.name = name
+        self.variants = {}  # encoding → bytes
+        self.hits = {}
+        self.not_modified = 0
+        self.bytes_sent = 0
+
+        ctype, enc = mimetypes.guess_type(name)
+        if ctype is None:
+            ctype = "application/octet-stream"
+        if ctype.startswith("text/") or ctype == "application/javascript":
+            ctype += "; charset=utf-8"
+        self.content_type = ctype
+
+        if path is not None:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if cfg.mmap_size and st.st_size >= cfg.mmap_size:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = self._mmap
+                else:
+                    data = self._data = f.read()
+            self.mtime = st.st_mtime
+            self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        else:
+            self._data = data
+
+        self.size = len(data)
+        self.etag = '"%s"' % sha1(data).hexdigest()
+
+        if _FINGERPRINT.search(name):
+            self.cache_control = "public, max-age=31536000, immutable"
+        else:
+            self.cache_control = "public, max-age=%d" % (cfg.max_age,)
+
+        if enc is None and self.size >= cfg.compress_min \
+                and _COMPRESSIBLE.match(ctype):
+            self._compress(data, cfg)
+
+    def _compress(self, data, cfg):
+        if cfg.gzip:
+            z = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(z) < self.size:
+                self.variants["gzip"] = z
+        if cfg.brotli and brotli is not None:
+            z = brotli.compress(bytes(data))
+            if len(z) < self.size:
+                self.variants["br"] = z
+
+    @property
+    def data(self):
+        """
+        The uncompressed content: `bytes`, or a `memoryview` of the
+        mmapped file.
+        """
+        if self._mmap is not None:
+            return memoryview(self._mmap)
+        return self._data
+
+    def select(self, accept: Dict[str,float]):
+        """
+        Choose the best encoding for this ``Accept-Encoding`` dict.
+
+        Returns a (encoding, body) tuple; the encoding is ``None`` if
+        the content should be sent as-is.
+        """
+        best = None
+        best_q = 0
+        for enc in _ENCODINGS:
+            if enc not in self.variants:
+                continue
+            q = accept.get(enc, accept.get("*", 0))
+            if q > best_q:
+                best, best_q = enc, q
+        if best is None:
+            return None, self.data
+        return best, self.variants[best]
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # still being sent; closed when that's done
+            self._mmap = None
+
+
+class StaticFiles:
+    """
+    Serves files from a list of directories. Earlier directories take
+    precedence.
+
+    Call :meth:`scan` to (re)load the files.
+    """
+    def __init__(self, dirs: List[str], cfg):
+        self.dirs = dirs
+        self.cfg = cfg
+        self.files = {}
+        self.misses = 0
+
+    def scan(self):
+        """
+        Read all files in the configured directories.
+        """
+        files = {}
+        for d in dict.fromkeys(self.dirs):
+            if not os.path.isdir(d):
+                continue
+            for dirpath, dirnames, filenames in os.walk(d):
+                dirnames[:] = [x for x in dirnames if x[0] != "."]
+                for fn in filenames:
+                    if fn[0] == ".":
+                        continue
+                    path = os.path.join(dirpath, fn)
+                    name = os.path.relpath(path, d).replace(os.sep, "/")
+                    if name in files:
+                        continue
+                    try:
+                        files[name] = Asset(name, self.cfg, path=path)
+                    except OSError:
+                        logger.exception("Cannot read %s", path)
+
+        old, self.files = self.files, files
+        for f in old.values():
+            f.close()
+        logger.debug("%d static files", len(files))
+
+    def add(self, name: str, data: bytes):
+        """
+        Register a generated file, e.g. a bundle.
+        """
+        a = self.files[name] = Asset(name, self.cfg, data=data)
+        return a
+
+    def bundle(self, name: str, files: List[str]) -> Optional[str]:
+        """
+        Concatenate some Javascript or CSS files to a single fingerprinted
+        bundle. Scripts that are not already minified are run through
+        ``rjsmin``, if that is available.
+
+        Args:
+          name: the bundle's name, e.g. ``df.js``.
+          files: the names of the files to bundle, in order.
+
+        Returns:
+          the fingerprinted name, e.g. ``df.0123abcd4567.js``, or ``None``
+          if a file is missing.
+        """
+        base, ext = os.path.splitext(name)
+        parts = []
+        for fn in files:
+            try:
+                data = bytes(self.files[fn].data)
+            except KeyError:
+                logger.warning("Not bundling %s: %s is missing", name, fn)
+                return None
+            if ext == ".js":
+                data = _SOURCEMAP.sub(b"", data)
+                if jsmin is not None and ".min." not in fn:
+                    data = jsmin(data)
+            parts.append(data)
+        data = (b";\n" if ext == ".js" else b"\n").join(parts)
+
+        name = "%s.%s%s" % (base, sha1(data).hexdigest()[:12], ext)
+        self.add(name, data)
+        return name
+
+    def lookup(self, name: str, headers) -> Optional[tuple]:
+        """
+        Find a file and decide how to send it.
+
+        Args:
+          name: the path of the file, relative to the static directories.
+          headers: the request's headers.
+
+        Returns:
+          a (status, body, headers) tuple, or ``None`` if there is no such file.
+        """
+        try:
+            a = self.files[name]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        hdr = {
+            "Content-Type": a.content_type,
+            "Cache-Control": a.cache_control,
+            "ETag": a.etag,
+        }
+        if a.last_modified is not None:
+            hdr["Last-Modified"] = a.last_modified
+        if a.variants:
+            hdr["Vary"] = "Accept-Encoding"
+
+        if self._not_modified(a, headers):
+            a.not_modified += 1
+            return 304, b"", hdr
+
+        enc, body = a.select(accepted_encodings(headers.get("Accept-Encoding")))
+        if enc is not None:
+            hdr["Content-Encoding"] = enc
+        if isinstance(body, memoryview):
+            body = _Chunks(body)
+            hdr["Content-Length"] = str(len(body))
+        a.hits[enc] = a.hits.get(enc, 0) + 1
+        a.bytes_sent += len(body)
+        return 200, body, hdr
+
+    @staticmethod
+    def _not_modified(a, headers) -> bool:
+        tags = parse_etags(headers.get("If-None-Match"))
+        if tags:
+            return a.etag in tags or "*" in tags
+        ims = headers.get("If-Modified-Since")
+        if ims and a.mtime is not None:
+            try:
+                t = parsedate_to_datetime(ims)
+                if t.tzinfo is None: # "-0000": UTC, not local time
+                    t = t.replace(tzinfo=timezone.utc)
+                return t.timestamp() >= int(a.mtime)
+            except (TypeError, ValueError):
+                pass
+        return False
+
+    def stats(self) -> dict:
+        """
+        Returns per-file counters: a dict of name → dict(hits, not_modified,
+        bytes), plus the number of misses as ``None``.
+        """
+        res = {
+            name: dict(hits=dict(a.hits), not_modified=a.not_modified, bytes=a.bytes_sent)
+            for name, a in self.files.items()
+        }
+        res[None] = self.misses
+        return res
@@ -0,0 +1,120 @@
+"""
+This module contains DeFramed's application-level frame compression.
+
+Browsers and Hypercorn usually negotiate permessage-deflate, which
+compresses the whole websocket stream. If that's not available (some
+proxies strip it) or you want to save the server memory it needs per
+connection, DeFramed can compress individual frames itself, optionally
+with a preset dictionary of typical HTML fragments.
+
+Compressed frames are sent as ``["z", data]``. The client inflates them
+with pako.
+"""
+
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, Optional
+
+from .util import packer
+
+__all__ = ["FrameCompressor", "train_dictionary", "SAMPLES"]
+
+# Some typical content. Used to build the default dictionary.
+SAMPLES = [
+    '<div class="container-fluid">', '<div class="row">', '<div class="col">',
+    '<button type="button" class="btn btn-primary">', '<button type="submit" class="btn btn-primary">',
+    '<button type="button" class="btn btn-secondary">', '<button type="button" class="close" data-dismiss="alert" aria-label="Close">',
+    '<span aria-hidden="true">&times;</span>', '<table class="table">', '<thead>', '<tbody>',
+    '<tr>', '<th>', '<td>', '</td>', '</th>', '</tr>', '</tbody>', '</thead>', '</table>',
+    '<form id="', '<input type="text" class="form-control" id="', '<label for="', '</label>',
+    '<div class="form-group">', '<p>', '</p>', '<br />', '</div>', '</span>', '</button>',
+    '<div class="alert alert-info" role="alert">', '<div class="alert alert-warning" role="alert">',
+    '<div class="alert alert-danger" role="alert">',
+    ' style="', 'margin:0px;', 'overflow:auto;', 'position:absolute;', 'display:flex;',
+    'justify-content:space-around;', 'align-items:center;', 'flex-direction:column;',
+    'width:100%;', 'height:100%;', 'background-color:', 'background-image:url(', 'font-weight:bold;',
+    'text-align:center;', 'background-size:contain;', '" data-parent-widget="', ' class="', ' id="',
+    'onclick="remi.sendCallback(', 'oncontextmenu="', 'event.stopPropagation();event.preventDefault();',
+    '<tr id="', '<td id="', '<div id="', '<p id="', '<button id="',
+    '" class="TableRow"', '" class="TableItem" style="', '" class="Container" style="',
+    '" class="Label" data-parent-widget="', '" class="Button"', '" class="Table"',
+    'set', 'elem', 'set_attr', 'info', 'level', 'text', 'timeout', 'busy',
+]
+
+_TOKEN = re.compile(r'<[^>]{1,80}>?|[^<]{1,80}')
+_IDS = re.compile(r'\d{8,}') # Remi uses id(widget)
+
+
+def train_dictionary(samples: Iterable[str], size: int = 16384) -> bytes:
+    """
+    Build a preset dictionary from some sample HTML.
+
+    Tags and text runs are counted; the ones that would save the most bytes
+    are put at the end of the dictionary, where zlib finds them most
+    cheaply.
+    """
+    count = Counter()
+    for s in samples:
+        for tok in _TOKEN.findall(_IDS.sub("", s)):
+            count[tok] += 1
+    toks = sorted(count, key=lambda t: count[t]*len(t))
+    res = []
+    n = 0
+    for tok in reversed(toks):
+        b = tok.encode("utf-8")
+        if n+len(b) > size:
+            break
+        res.append(b)
+        n += len(b)
+    return b"".join(reversed(res))
+
+
+class FrameCompressor:
+    """
+    Compress frames, individually.
+
+    Args:
+      mode:
+        ``"deflate"`` or ``"dict"``.
+      zdict:
+        the preset dictionary, if mode is ``"dict"``.
+      min_size:
+        Frames smaller than this are not compressed.
+    """
+    def __init__(self, mode: str, zdict: Optional[bytes] = None, min_size: int = 128):
+        if mode not in ("deflate", "dict"):
+            raise ValueError("Unknown compression mode", mode)
+        self.mode = mode
+        self.zdict = zdict if mode == "dict" else None
+        self.min_size = min_size
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def setup_msg(self) -> Optional[bytes]:
+        """
+        The message that tells the client about the dictionary.
+        """
+        if self.zdict is None:
+            return None
+        return packer(["zdict", self.zdict])
+
+    def compress(self, msg: bytes) -> bytes:
+        """
+        Compress a frame, if that helps.
+        """
+        if len(msg) < self.min_size:
+            return msg
+        if self.zdict is not None:
+            c = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=self.zdict)
+        else:
+            c = zlib.compressobj(6, zlib.DEFLATED, -15)
+        z = c.compress(msg) + c.flush()
+        z = packer(["z", z])
+        if len(z) >= len(msg):
+            return msg
+        self.frames += 1
+        self.bytes_in += len(msg)
+        self.bytes_out += len(z)
+        return z
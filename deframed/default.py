@@ -48,7 +48,60 @@ CFG = attrdict(
         certfile=None,
         keyfile=None,
     ),
+    runner=attrdict( # multi-process server, see deframed.runner
+        processes=0, # number of server processes; 0: one per CPU
+        socket_dir=None, # for relaying sessions between processes; default: a temp dir
+        restart_delay=1, # seconds to wait before restarting a dead process
+    ),
+    assets=attrdict( # static files, served from memory
+        max_age=3600, # Cache-Control for files without a hash in their name
+        compress_min=256, # don't compress smaller files
+        mmap_size=1024*1024, # map files this large instead of reading them
+        gzip=True,
+        brotli=True, # if the "brotli" module is available
+        bundle=[ # concatenated to a single script if all are present
+            "ext/jquery.min.js",
+            "ext/poppler.min.js",
+            "ext/bootstrap.min.js",
+            "ext/msgpack.min.js",
+            "ext/mustache.min.js",
+            "ext/pako_inflate.min.js",
+            "main.js",
+        ],
+        bundle_css=[
+            "ext/bootstrap.min.css",
+            "site.css",
+        ],
+    ),
+    ws=attrdict( # websocket handling
+        batch_max=100, # max number of messages per frame
+        batch_delay=0, # seconds to wait for more messages
+        queue_len=10, # max number of queued messages
+        queue_bytes=1024*1024, # max size of queued messages
+        window=256*1024, # max bytes not yet acknowledged by the client
+        in_queue_len=100, # max number of incoming messages not yet handled
+        compress=None, # compress frames: None, "deflate", or "dict"
+        compress_min=128, # don't compress smaller frames
+        compress_pmd=False, # compress even if the client uses permessage-deflate
+        compress_dict=None, # file with a preset dictionary for "dict"
+        compress_samples=[], # HTML files to build the dictionary from
+        replay_len=100, # max number of unacknowledged frames kept for resuming
+        replay_bytes=1024*1024, # max size of unacknowledged frames kept
+    ),
+    session=attrdict( # session registry
+        grace=60, # seconds to keep a disconnected session for resuming
+        idle=0, # evict sessions whose client has been silent this long; 0: never
+        max_sessions=0, # evict the least recently used sessions beyond this; 0: no limit
+        max_bytes=0, # ditto, when their estimated memory use exceeds this
+        sweep=5, # seconds between checks
+    ),
+    trace=attrdict( # per-session ring buffer of websocket frames
+        size=100, # frames per session
+        sample=0.0, # fraction of sessions to trace, 0 to 1
+    ),
     mainpage="templates/layout.mustache",
+    templates=[], # directories with Mustache templates for Worker.render
+    mainpage_reload=False, # re-read the main page when it changes (for development)
     debug=False,
     data=attrdict( # passed to main template
         title="Test page. Do not test!",
@@ -61,6 +114,7 @@ CFG = attrdict(
             bootstrap_js="https://stackpath.bootstrapcdn.com/bootstrap/4.4.1/js/bootstrap.min.js",
             poppler="https://cdn.jsdelivr.net/npm/popper.js@1.16.0/dist/umd/popper.min.js",
             jquery="https://code.jquery.com/jquery-3.4.1.slim.min.js",
+            pako="https://cdn.jsdelivr.net/npm/pako@2.1.0/dist/pako_inflate.min.js",
         ),
         static="static", # path
     ),
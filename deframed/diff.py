@@ -0,0 +1,217 @@
+"""
+This module contains DeFramed's HTML differ.
+
+When a worker's ``diff`` attribute is set, it remembers the HTML it sent to
+each element. The next update to that element is sent as a list of
+patches which the client applies in place, instead of re-parsing the
+whole subtree.
+
+Patches are lists. ``path`` is a list of child node indices, starting at
+the updated element (``set``) or at a virtual parent of the replaced
+element (``elem``):
+
+* ``["t", path, text]`` – set a text node
+* ``["a", path, tag, {name: value}]`` – set attributes; ``None`` removes one
+* ``["r", path, tag, html]`` – replace a node; ``tag`` is the old one's
+  ``nodeName``, i.e. ``"#text"`` or ``"#comment"`` if it's not an element
+* ``["i", path, tag, index, html]`` – insert nodes before child ``index``
+* ``["d", path, tag, index, count]`` – remove ``count`` children
+
+The client checks node types and tag names as it goes, and asks for the
+full content if something doesn't match.
+
+Elements that the browser adds implicitly (``<tbody>`` in a table, ``<tr>``
+around stray cells, ``<colgroup>``) are added by `parse` too, so that
+paths count the same nodes on both ends.
+"""
+
+from html import escape
+from html.parser import HTMLParser
+from typing import List, Optional
+
+__all__ = ["parse", "serialize", "diff"]
+
+VOID = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr"))
+RAW = frozenset(("script", "style"))
+_TBODY = frozenset(("tbody", "thead", "tfoot"))
+
+
+class Elem:
+    """
+    An HTML element.
+    """
+    __slots__ = ("tag", "attrs", "children")
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+
+    def __eq__(self, other):
+        return type(other) is Elem and self.tag == other.tag and \
+            self.attrs == other.attrs and self.children == other.children
+
+    def __repr__(self):
+        return "<%s %r %r>" % (self.tag, self.attrs, self.children)
+
+
+class Comment(str):
+    """
+    An HTML comment. Kept because the browser counts it as a node.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(other) is Comment and str.__eq__(self, other)
+
+    __hash__ = str.__hash__
+
+
+class _Parser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Elem(None, {})
+        self.stack = [self.root]
+
+    def _implicit(self, tag):
+        # Add the elements the browser inserts on its own.
+        parent = self.stack[-1].tag
+        if parent == "colgroup" and tag != "col":
+            # a column group only contains columns
+            self.stack.pop()
+            parent = self.stack[-1].tag
+        if parent == "table":
+            if tag == "col":
+                self._open("colgroup")
+            elif tag in ("tr", "td", "th"):
+                self._open("tbody")
+                parent = "tbody"
+        if parent in _TBODY and tag in ("td", "th"):
+            self._open("tr")
+
+    def _open(self, tag, attrs=None):
+        e = Elem(tag, {} if attrs is None else attrs)
+        self.stack[-1].children.append(e)
+        self.stack.append(e)
+        return e
+
+    def handle_starttag(self, tag, attrs):
+        self._implicit(tag)
+        self._open(tag, {k: ("" if v is None else v) for k,v in attrs})
+        if tag in VOID:
+            self.stack.pop()
+
+    def handle_startendtag(self, tag, attrs):
+        self._implicit(tag)
+        e = Elem(tag, {k: ("" if v is None else v) for k,v in attrs})
+        self.stack[-1].children.append(e)
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack)-1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+        # stray end tag: ignored, like the browser does
+
+    def handle_data(self, data):
+        c = self.stack[-1].children
+        if c and type(c[-1]) is str:
+            c[-1] += data
+        else:
+            c.append(data)
+
+    def handle_comment(self, data):
+        self.stack[-1].children.append(Comment(data))
+
+
+def parse(html: str) -> list:
+    """
+    Parse an HTML fragment into a list of nodes: strings for text,
+    `Comment`, and `Elem`.
+    """
+    p = _Parser()
+    p.feed(html)
+    p.close()
+    return p.root.children
+
+
+def serialize(nodes: list, raw: bool = False) -> str:
+    """
+    Turn a list of nodes back into HTML.
+    """
+    res = []
+    for n in nodes:
+        if type(n) is Elem:
+            res.append("<"+n.tag)
+            for k,v in n.attrs.items():
+                res.append(' %s="%s"' % (k, escape(v)))
+            res.append(">")
+            if n.tag not in VOID:
+                res.append(serialize(n.children, n.tag in RAW))
+                res.append("</%s>" % (n.tag,))
+        elif type(n) is Comment:
+            res.append("<!--%s-->" % (n,))
+        else:
+            res.append(n if raw else escape(n, quote=False))
+    return "".join(res)
+
+
+def diff(old: list, new: list, elem: bool = False) -> Optional[List[list]]:
+    """
+    Returns the patches that turn ``old`` into ``new``, both lists of nodes.
+
+    If ``elem`` is set, both must contain a single element;
+    `None` is returned if that's not the case.
+    """
+    if elem and (len(old) != 1 or len(new) != 1 or type(old[0]) is not Elem
+            or type(new[0]) is not Elem):
+        return None
+    ops = []
+    _diff_children(old, new, [], None, ops)
+    return ops
+
+
+def _diff_children(old, new, path, tag, ops):
+    lo, ln = len(old), len(new)
+    p = 0
+    while p < lo and p < ln and old[p] == new[p]:
+        p += 1
+    s = 0
+    while s < lo-p and s < ln-p and old[lo-1-s] == new[ln-1-s]:
+        s += 1
+    mo, mn = lo-p-s, ln-p-s
+    m = min(mo, mn)
+    for i in range(p, p+m):
+        _diff_node(old[i], new[i], path+[i], ops)
+    if mo > m:
+        ops.append(["d", path, tag, p+m, mo-m])
+    elif mn > m:
+        ops.append(["i", path, tag, p+m, serialize(new[p+m:p+mn], tag in RAW)])
+
+
+def _diff_node(a, b, path, ops):
+    if a == b:
+        return
+    if type(a) is str and type(b) is str:
+        ops.append(["t", path, b])
+    elif type(a) is Elem and type(b) is Elem and a.tag == b.tag:
+        if a.attrs != b.attrs:
+            chg = {k: v for k,v in b.attrs.items() if a.attrs.get(k) != v}
+            for k in a.attrs:
+                if k not in b.attrs:
+                    chg[k] = None
+            ops.append(["a", path, a.tag, chg])
+        if a.children != b.children:
+            _diff_children(a.children, b.children, path, a.tag, ops)
+    else:
+        ops.append(["r", path, _node_name(a), serialize([b])])
+
+
+def _node_name(n):
+    # what the browser's ``nodeName`` says, lower-cased
+    if type(n) is Elem:
+        return n.tag
+    if type(n) is Comment:
+        return "#comment"
+    return "#text"
@@ -3,12 +3,15 @@ Worker mix-in class that supports Remi.
 """
 
 import os
+import math
 import trio
+import inspect
 import weakref
 
 from . import gui as remi
-from .server import runtimeInstances
-from ..worker import SubWorker
+from . import render
+from .server import runtimeInstances, widgets_of
+from ..worker import SubWorker, run_ordered
 
 import deframed
 
@@ -23,13 +26,24 @@ class _Remi:
     """
 
     _update_new = None
+    _hold = 0  # number of Remi callbacks that are queued or running
+
+    hold_max = 0.5
+    # While callbacks are running, changes are sent at most this often,
+    # so that a long callback doesn't freeze the client.
 
     def __init__(self,*a,**k):
         self._update_evt = trio.Event()
+        self._dirty = set()  # widgets changed since the last update
         super().__init__(*a,**k)
 
-    def _need_update(self):
+    def _need_update(self, *a, **k):
         """Callback for updating the client"""
+        if self._hold:
+            # flushed when the callbacks are done, or by the update loop
+            # if that takes too long. Also, this might be called from a
+            # thread.
+            return
         self._update_evt.set()
 
     def onload(self, emitter):
@@ -65,23 +79,36 @@ class _Remi:
 
     def set_root_widget(self,w):
         self._update_new = w
-        self._update_evt.set()
+        self._need_update()
 
     async def update_loop(self):
         while True:
-            await self._update_evt.wait()
+            if self._hold:
+                with trio.move_on_after(self.hold_max):
+                    await self._update_evt.wait()
+            else:
+                await self._update_evt.wait()
             self._update_evt = trio.Event()
+            if not self._dirty and self._update_new is None:
+                continue
             logger.debug("Update")
             if self._update_new is None:
-                changed = {}
-                self.gui.repr(changed)
-                for widget,html in changed.items():
-                    logger.debug("Updating %s",widget)
-                    __id = str(widget.identifier)
-                    await self.worker.set_element(str(widget.identifier),html)
+                changed = render.changed(self.gui, self._dirty)
+                if changed:
+                    logger.debug("Updating %d widgets", len(changed))
+                    elems = {}
+                    patches = {}
+                    for widget,html in changed.items():
+                        if isinstance(html, str):
+                            elems[str(widget.identifier)] = html
+                        else:
+                            patches[str(widget.identifier)] = html
+                    await self.worker.set_elements(elems, patches)
             else:
                 self.gui = self._update_new
-                await self.worker.set_content(self.gui_id, self.gui.repr({}))
+                self.gui._parent = self
+                self._dirty.clear()
+                await self.worker.set_content(self.gui_id, render.html(self.gui))
                 self._update_new = None
 
 
@@ -89,22 +116,131 @@ class _Remi:
         pass
 
 
+def in_thread(proc):
+    """
+    Mark a (synchronous) Remi callback to run in a thread, so that it
+    doesn't block the session::
+
+        @in_thread
+        def on_click(self, widget):
+            ...
+
+    Remi isn't thread safe. Don't modify widgets that some other code
+    might be modifying at the same time.
+    """
+    proc._df_thread = True
+    return proc
+
+
 class RemiSupport:
     """
     A mix-in which forwards Remi events to its handler.
 
     Use this in your app.
+
+    Callbacks run in a background task. They may be coroutines. The
+    client is updated once all queued callbacks are done, or every
+    `_Remi.hold_max` seconds while they take longer than that.
     """
 
+    remi_concurrency = 1
+    # Max number of Remi callbacks that run in parallel. Callbacks for
+    # which `remi_order_key` returns the same key always run in order.
+
+    remi_queue = 100
+    # Max number of Remi callbacks that are queued or running. Further
+    # events wait, which blocks the session's reader.
+
+    remi_threads = 4
+    # Max number of `in_thread` callbacks that run in parallel.
+
+    _remi_q = None
+
+    def remi_order_key(self, widget_id, function_name):
+        """
+        If `remi_concurrency` is more than one, callbacks for which this
+        method returns the same key run in order.
+
+        The default is to order by widget.
+        """
+        return widget_id
+
     async def msg_remi_event(self, data):
         widget_id, function_name, params = data
-        callback = getattr(runtimeInstances[widget_id], function_name, None)
+        widgets = widgets_of(self)
+        callback = getattr(runtimeInstances.get(widget_id, widgets), function_name, None)
         if not params:
             params = {}
-        if callback is not None:
-            callback(**params)
-        else:
+        if callback is None:
             logger.debug("Unknown callback: %s %s %r", *data)
+            return
+
+        if self._remi_q is None:
+            self._remi_limit = trio.Semaphore(self.remi_queue)
+            self._remi_q, q = trio.open_memory_channel(math.inf)
+            await self.spawn(self._remi_run, q)
+        await self._remi_limit.acquire()
+        h = self._remi_handler()
+        if h is not None:
+            if not h._hold:
+                h._update_evt.set() # the update loop now needs a timeout
+            h._hold += 1
+        self._remi_q.send_nowait((self.remi_order_key(widget_id, function_name),
+            callback, params, h))
+
+    def _remi_handler(self):
+        h = getattr(self, "_remi", None)
+        return None if h is None else h()
+
+    async def _remi_run(self, q):
+        """
+        Run queued Remi callbacks.
+        """
+        threads = trio.CapacityLimiter(self.remi_threads)
+        if self.remi_concurrency <= 1:
+            async for _, *args in q:
+                await self._remi_call(*args, threads)
+            return
+
+        # `remi_queue` already limits the number of pending callbacks
+        await run_ordered(q, lambda item: self._remi_call(*item[1:], threads),
+            lambda item: item[0], self.remi_concurrency)
+
+    async def _remi_call(self, callback, params, h, threads):
+        widgets = widgets_of(self)
+        try:
+            if getattr(getattr(callback, "callback", None), "_df_thread", False):
+                def call():
+                    with widgets.active():
+                        callback(**params)
+                await trio.to_thread.run_sync(call, limiter=threads)
+            else:
+                with widgets.active():
+                    res = callback(**params)
+                    if inspect.isawaitable(res):
+                        await res
+        except Exception:
+            logger.exception("Remi callback %r", callback)
+        finally:
+            self._remi_limit.release()
+            if h is not None:
+                h._hold -= 1
+                if not h._hold:
+                    h._update_evt.set()
+
+    async def evicted(self, reason: str):
+        widgets_of(self).clear()
+        await super().evicted(reason)
+
+    def stats(self) -> dict:
+        """
+        Returns some statistics about this session.
+
+        This adds the number of Remi ``widgets``.
+        """
+        res = super().stats()
+        res["widgets"] = len(widgets_of(self))
+        return res
 
 
 class RemiHandler(_Remi):
@@ -122,7 +258,9 @@ class RemiHandler(_Remi):
     def __init__(self, worker):
         super().__init__()
         self.worker = worker
-        self.gui = self.main()
+        self.widgets = widgets_of(worker)
+        with self.widgets.active():
+            self.gui = self.main()
         worker._remi = weakref.ref(self)
 
     @property
@@ -137,7 +275,8 @@ class RemiHandler(_Remi):
 
         Call "hide_embed" when you're done.
         """
-        self._task = await self.worker.spawn(self._show,id, persistent=False)
+        with self.widgets.active():
+            self._task = await self.worker.spawn(self._show,id, persistent=False)
 
     async def _show(self,id):
         w = self.worker
@@ -145,7 +284,7 @@ class RemiHandler(_Remi):
         self.gui_id = id
 
         await w.add_class(id, 'remi-main')
-        await w.set_content(id, self.gui.repr({}))
+        await w.set_content(id, render.html(self.gui))
 
         async with trio.open_nursery() as n:
             n.start_soon(self.update_loop)
@@ -174,6 +313,7 @@ class _RemiWorker(_Remi, SubWorker):
     def __init__(self, worker, gui, name):
         self.gui = gui
         self._update_evt = trio.Event()
+        self._dirty = set()
         self._update_loop = None
 
         _Remi.init(worker,gui)
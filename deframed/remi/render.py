@@ -0,0 +1,173 @@
+"""
+Incremental rendering of Remi GUIs.
+
+Remi finds out what to send to the client by walking the whole widget
+tree on every update. Instead, we note which widgets change while that
+happens and render only those. A widget's HTML is cached (in Remi's own
+``_backup_repr``), so re-rendering a parent re-uses the HTML of its
+unchanged children instead of visiting them.
+
+If only a widget's attributes, style, or text changed, the client gets
+just these changes instead of the whole element.
+
+Importing this module hooks into Remi's ``Tag``. A widget's changes are
+recorded in the ``_dirty`` set of whatever is at the top of its tree,
+if it has one; `deframed.remi._Remi` does.
+"""
+
+from .gui import Tag, Widget
+
+__all__ = ["html", "changed"]
+
+_plain = (Tag.repr, Widget.repr)
+_no_text = frozenset(("textarea",))  # the browser ignores changed content
+_need_update = Tag._need_update
+
+
+def _tracked_need_update(self, emitter=None, *a, **k):
+    if emitter is not None:
+        # This widget changed, thus the cached HTML of its parents is stale.
+        p = self._parent
+        while isinstance(p, Tag):
+            p._df_stale = True
+            p = p._parent
+        dirty = getattr(p, "_dirty", None)
+        if dirty is not None:
+            dirty.add(self)
+    _need_update(self, emitter, *a, **k)
+
+Tag._need_update = _tracked_need_update
+Tag._df_stale = False
+
+_remove_child = Tag.remove_child
+
+
+def _tracked_remove_child(self, child):
+    _remove_child(self, child)
+    if getattr(child, "_parent", None) is self and child not in self.children.values():
+        # Remi keeps the link, thus the child's changes would still be sent.
+        child._parent = None
+
+Tag.remove_child = _tracked_remove_child
+
+
+def html(widget: Tag) -> str:
+    """
+    Returns a widget's HTML.
+
+    Only the parts of the tree that changed since the last call are
+    rendered again.
+    """
+    if type(widget).repr not in _plain:
+        # HTML, HEAD, or something else we don't know how to cache
+        return widget.repr({})
+    stale = widget.__dict__.pop("_df_stale", False)
+    if widget._backup_repr and not stale and not widget._ischanged():
+        return widget._backup_repr
+
+    res = []
+    text = True
+    for k in widget._render_children_list:
+        c = widget.children[k]
+        if isinstance(c, Tag):
+            res.append(html(c))
+            text = False
+        elif isinstance(c, str):
+            res.append(c)
+        else:
+            res.append(repr(c))
+    inner = "".join(res)
+    widget._backup_repr = "".join(("<", widget.type, " ", widget._repr_attributes, ">",
+        inner, "</", widget.type, ">"))
+    # remember what the client has, for `_patch`
+    widget._df_sent = (dict(widget.attributes), dict(widget.style),
+        inner if text else None)
+    widget._set_updated()
+    return widget._backup_repr
+
+
+def _changes(old: dict, new: dict) -> dict:
+    res = {}
+    for k,v in new.items():
+        if k not in old or old[k] != v:
+            res[k] = "" if v is None else str(v)
+    for k in old:
+        if k not in new:
+            res[k] = None
+    return res
+
+
+def _patch(widget: Tag):
+    """
+    Returns the changes to a widget since it was last rendered, as
+    ``(attrs, style, content)``, or `None` if the whole element needs to
+    be replaced.
+
+    ``content`` is `None` if it didn't change. It can only change if
+    the widget doesn't have child widgets.
+    """
+    old = widget.__dict__.get("_df_sent")
+    if old is None or type(widget).repr not in _plain:
+        return None
+    attrs, style, text = old
+    content = None
+    if widget.children.changed:
+        if text is None or widget.type in _no_text:
+            return None
+        res = []
+        for k in widget._render_children_list:
+            c = widget.children[k]
+            if isinstance(c, Tag):
+                return None
+            res.append(c if isinstance(c, str) else repr(c))
+        content = "".join(res)
+        if content == text:
+            content = None
+    a = _changes(attrs, widget.attributes)
+    # Remi renders the style dict as the "style" attribute
+    a.pop("style", None)
+    return a, _changes(style, widget.style), content
+
+
+def changed(root: Tag, dirty: set) -> dict:
+    """
+    Render the widgets in ``dirty`` that are (still) part of ``root``'s
+    tree, and clear the set.
+
+    Returns a dict of widgets to their HTML, like Remi's ``repr`` does,
+    or to their changes (see `_patch`) if they can be updated in place.
+    A widget is left out if one of its parents is in it, or if nothing
+    the client can see has changed.
+    """
+    todo = []
+    for w in dirty:
+        depth = 0
+        p = w
+        while p is not root:
+            if not isinstance(p, Tag):
+                break # not in this tree (any more)
+            p = p._parent
+            depth += 1
+        else:
+            todo.append((depth, w))
+    dirty.clear()
+
+    # Parents first. Replacing them also renders their changed children,
+    # which are then no longer changed.
+    todo.sort(key=lambda x: x[0])
+    res = {}
+    patched = []
+    for _, w in todo:
+        if not w._ischanged():
+            continue
+        p = _patch(w)
+        if p is None:
+            res[w] = html(w)
+        else:
+            # Don't render it yet: that would hide changes of its children.
+            patched.append(w)
+            if any(x for x in p):
+                res[w] = p
+    for w in patched:
+        html(w)
+    return res
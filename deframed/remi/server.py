@@ -1,8 +1,112 @@
+"""
+What Remi's GUI code needs from its server.
 
-# An unfortunate global. Oh well.
+Remi registers each widget in ``runtimeInstances`` so that events can
+find it. Here, each session has its own `Widgets` registry instead. The
+registry that's in use is kept in a context variable, see
+`Widgets.active`.
+"""
 
 import weakref
-runtimeInstances = weakref.WeakValueDictionary()
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+__all__ = ["Widgets", "widgets_of", "runtimeInstances"]
+
+current = ContextVar("remi_widgets", default=None)
+
+
+class Widgets:
+    """
+    A session's Remi widgets, by ID.
+
+    Widgets created while the registry is active get short numeric IDs
+    instead of Remi's ``id(widget)``. Only weak references are kept.
+    """
+    def __init__(self):
+        self._w = weakref.WeakValueDictionary()
+        self._n = 0
+
+    def __len__(self):
+        return len(self._w)
+
+    def add(self, widget, ident: str = None) -> str:
+        """
+        Register a widget. Returns its ID; a new one if none is given.
+        """
+        if ident is None:
+            self._n += 1
+            ident = str(self._n)
+        self._w[ident] = widget
+        return ident
+
+    def get(self, ident: str):
+        return self._w.get(ident)
+
+    def clear(self):
+        """
+        Forget all widgets. Called when the session ends.
+        """
+        self._w.clear()
+
+    @contextmanager
+    def active(self):
+        """
+        Widgets created within this block (and in tasks started from it)
+        are registered here.
+        """
+        tk = current.set(self)
+        try:
+            yield self
+        finally:
+            current.reset(tk)
+
+
+def widgets_of(worker) -> Widgets:
+    """
+    Returns this worker's widget registry.
+    """
+    w = getattr(worker, "_remi_widgets", None)
+    if w is None:
+        w = worker._remi_widgets = Widgets()
+    return w
+
+
+class _Instances:
+    """
+    Replaces Remi's global ``runtimeInstances``: widgets go to the current
+    session's registry.
+
+    Widgets that are created outside of a session (e.g. when a module is
+    imported) are kept here.
+    """
+    def __init__(self):
+        self._unscoped = weakref.WeakValueDictionary()
+
+    def __setitem__(self, ident, widget):
+        reg = current.get()
+        if reg is None:
+            self._unscoped[ident] = widget
+        elif ident == str(id(widget)) and \
+                getattr(widget, "attributes", {}).get('id') == ident:
+            # Remi's default ID. Use a short one instead, unless the
+            # widget's actual ID was set explicitly.
+            widget.attributes['id'] = reg.add(widget)
+        else:
+            reg.add(widget, ident)
+
+    def get(self, ident: str, widgets: Widgets = None):
+        """
+        Find a widget, in this registry if given, or created outside of
+        a session.
+        """
+        if widgets is not None:
+            w = widgets.get(ident)
+            if w is not None:
+                return w
+        return self._unscoped.get(ident)
+
+runtimeInstances = _Instances()
 
 # dummies for GUI
 App = None
@@ -0,0 +1,292 @@
+"""
+This module contains DeFramed's multi-process runner.
+
+Sessions live in the memory of the process that created them. The runner
+forks a number of server processes which share the listening port
+(``SO_REUSEPORT``), so the kernel distributes new connections among them.
+
+A client that reconnects tells the server its session ID in the websocket
+URL (``/ws?s=UUID``). The process's number is part of that ID; if the
+connection ends up in the wrong process, its frames are relayed to the
+right one through a Unix socket.
+
+This is Linux-only.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import struct
+import tempfile
+from typing import Optional
+from uuid import UUID
+
+import trio
+
+from .util import packer, unpacker
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ["Runner", "RelayedWebsocket"]
+
+_HDR = struct.Struct("!IB") # length, is_text
+
+
+async def send_frame(stream, msg):
+    """
+    Send a websocket frame through a stream.
+    """
+    is_text = isinstance(msg, str)
+    if is_text:
+        msg = msg.encode("utf-8")
+    await stream.send_all(_HDR.pack(len(msg), is_text) + msg)
+
+
+async def receive_frame(stream, buf: bytearray):
+    """
+    Read a websocket frame from a stream.
+
+    Returns ``None`` at EOF.
+    """
+    while True:
+        if len(buf) >= _HDR.size:
+            n, is_text = _HDR.unpack_from(buf)
+            if len(buf) >= _HDR.size+n:
+                msg = bytes(buf[_HDR.size:_HDR.size+n])
+                del buf[:_HDR.size+n]
+                return msg.decode("utf-8") if is_text else msg
+        data = await stream.receive_some(65536)
+        if not data:
+            return None
+        buf += data
+
+
+def process_of(uuid: Optional[str], processes: int) -> Optional[int]:
+    """
+    Returns the number of the process that owns this session, or ``None``
+    if the ID is missing or wasn't generated by a runner with this many
+    processes.
+    """
+    if not uuid:
+        return None
+    try:
+        node = UUID(uuid).node
+    except ValueError:
+        return None
+    if node >= processes:
+        return None
+    return node
+
+
+class RelayedWebsocket:
+    """
+    The owning process's end of a relayed websocket.
+
+    It has the subset of Quart's websocket interface that the `Talker`
+    uses. When the relay closes, the scope in which the worker runs is
+    cancelled, just like Quart cancels a websocket handler when the client
+    goes away.
+    """
+    def __init__(self, stream, headers, scope):
+        self.stream = stream
+        self.headers = headers
+        self._scope = scope
+        self._buf = bytearray()
+        self._lock = trio.Lock()
+
+    async def send(self, msg):
+        async with self._lock:
+            await send_frame(self.stream, msg)
+
+    async def receive(self):
+        msg = await receive_frame(self.stream, self._buf)
+        if msg is None:
+            self._scope.cancel()
+            await trio.sleep_forever()
+        return msg
+
+
+async def relay(websocket, path: str) -> bool:
+    """
+    Relay this websocket to the process listening on ``path``.
+
+    Returns False if that process isn't there.
+    """
+    try:
+        stream = await trio.open_unix_socket(path)
+    except OSError:
+        return False
+    async with stream:
+        hdr = {}
+        for k in ("Sec-WebSocket-Extensions", "User-Agent"):
+            v = websocket.headers.get(k)
+            if v is not None:
+                hdr[k] = v
+        await send_frame(stream, packer(hdr))
+
+        async def back(scope):
+            buf = bytearray()
+            while True:
+                msg = await receive_frame(stream, buf)
+                if msg is None:
+                    scope.cancel()
+                    return
+                await websocket.send(msg)
+
+        async with trio.open_nursery() as n:
+            n.start_soon(back, n.cancel_scope)
+            while True:
+                await send_frame(stream, await websocket.receive())
+    return True
+
+
+async def serve_relayed(app, path: str, *, task_status=trio.TASK_STATUS_IGNORED):
+    """
+    Accept websockets relayed from other processes.
+    """
+    sock = trio.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    await sock.bind(path)
+    sock.listen(100)
+
+    async def handler(stream):
+        async with stream:
+            hdr = await receive_frame(stream, bytearray())
+            if hdr is None:
+                return
+            with trio.CancelScope() as sc:
+                ws = RelayedWebsocket(stream, unpacker(hdr), sc)
+                w = app.worker(app)
+                await w.run(ws)
+
+    await trio.serve_listeners(handler, [trio.SocketListener(sock)],
+            task_status=task_status)
+
+
+class Runner:
+    """
+    Run an `App` in several processes, and restart them when they die.
+
+    Args:
+      app:
+        the application. Create it before starting the runner; it is
+        shared by all processes.
+
+    Call :meth:`run`. It returns when the runner gets a SIGINT or SIGTERM.
+
+    Configuration is in the ``runner`` section.
+    """
+    def __init__(self, app):
+        self.app = app
+        cfg = app.cfg.runner
+        self.cfg = cfg
+        self.processes = cfg.processes or os.cpu_count() or 1
+        self.socket_dir = cfg.socket_dir
+        self._pids = {} # pid > process number
+        self._started = {} # process number > time.monotonic
+        self._delay = {} # process number > restart delay
+        self._due = {} # process number > time.monotonic to restart it
+        self._stopping = False
+        self.restarts = 0
+
+    def run(self):
+        """
+        Start the server processes and supervise them.
+        """
+        if self.socket_dir is None:
+            self.socket_dir = tempfile.mkdtemp(prefix="deframed.")
+        old = {}
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            old[sig] = signal.signal(sig, self._stop)
+        try:
+            for i in range(self.processes):
+                self._start(i)
+            self._supervise()
+        finally:
+            for sig, h in old.items():
+                signal.signal(sig, h)
+            self._stop()
+
+    def _supervise(self):
+        """
+        Wait for processes to die, and restart them when they're due.
+        """
+        while self._pids or self._due:
+            now = time.monotonic()
+            for i, t in list(self._due.items()):
+                if t <= now:
+                    del self._due[i]
+                    self.restarts += 1
+                    self._start(i)
+            if self._due:
+                # don't block, a restart is pending
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    pid = 0
+                if not pid:
+                    time.sleep(max(0, min(min(self._due.values())-now, 0.1)))
+                    continue
+            else:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+            i = self._pids.pop(pid, None)
+            if i is None or self._stopping:
+                continue
+            logger.warning("Process %d (%d) died: %s", i, pid, status)
+            self._restart(i)
+
+    def _stop(self, *_):
+        # This is a signal handler: the supervisor might be changing
+        # `_pids` right now.
+        self._stopping = True
+        self._due.clear()
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _restart(self, i):
+        """
+        Schedule restarting process ``i``.
+        """
+        # back off if the process keeps crashing right after starting
+        delay = self.cfg.restart_delay
+        if time.monotonic()-self._started[i] < self.cfg.restart_delay*10:
+            delay = min(self._delay.get(i, delay)*2, 60)
+        self._delay[i] = delay
+        self._due[i] = time.monotonic()+delay
+
+    def _start(self, i):
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = i
+            self._started[i] = time.monotonic()
+            return
+
+        # child
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, signal.SIG_DFL)
+        res = 0
+        try:
+            app = self.app
+            app.process = i
+            app.processes = self.processes
+            app.socket_dir = self.socket_dir
+            trio.run(app.run)
+        except BaseException:
+            logger.exception("Process %d", i)
+            res = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(res)
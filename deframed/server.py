@@ -1,23 +1,32 @@
 import os
 import trio
+import socket
 from typing import Optional, Any
 from functools import partial
 from quart_trio import QuartTrio as Quart
 from hypercorn.config import Config as HyperConfig
 from hypercorn.trio import serve as hyper_serve
 from quart.logging import create_serving_logger
-from quart import jsonify, websocket, Response
+from quart import jsonify, websocket, request, Response
 from werkzeug.exceptions import NotFound
-from quart.helpers import send_from_directory
 from weakref import WeakValueDictionary
+from hashlib import sha1
 import chevron
+from chevron.tokenizer import tokenize
 
 from .util import attrdict, combine_dict
 from .default import CFG
-from .worker import Worker, Talker
+from .worker import Worker, Talker, PackedMessage
+from .assets import StaticFiles, parse_etags
+from .compress import FrameCompressor, train_dictionary, SAMPLES
+from .session import Sessions
+from .runner import process_of, relay, serve_relayed
 
 import deframed
 
+import logging
+logger = logging.getLogger(__name__)
+
 class App:
     """
     This is deframed's main code.
@@ -28,13 +37,32 @@ class App:
         cfg = combine_dict(cfg, CFG, cls=attrdict)
         self.cfg = cfg
         self.main = None # Nursery
-        self.clients = WeakValueDictionary()
+        self.clients = Sessions(cfg.session)
+        self.groups = {} # name > set of workers
         self.worker = worker
         self.sub_worker = WeakValueDictionary()
         self._sw_id = 0
         self.version = worker.version or deframed.__version__
         self.debug=debug or cfg.debug
 
+        # set by deframed.runner.Runner in each server process
+        self.process = None
+        self.processes = 1
+        self.socket_dir = None
+
+        self._zdict = None
+        if cfg.ws.compress == "dict":
+            self._zdict = self._load_zdict()
+
+        self._main_path = None
+        self._main_mtime = None
+        self._main_tokens = None
+        self._main_cache = {}
+        self._load_mainpage()
+
+        self._templates = {} # name > (hash, text)
+        self._tpl_hash = {} # hash > text
+
         self.app = Quart(cfg.server.name,
                 # no, we do not want any of those default folders and whatnot
                 static_folder=None,template_folder=None,root_path="/nonexistent",
@@ -44,26 +72,28 @@ class App:
         @self.app.route("/", defaults={"p":None}, methods=['GET'])
         async def index(p):
             # "path" is unused, the app will get it via Javascript
-            try:
-                f = open(cfg.mainpage)
-            except OSError:
-                f = open(os.path.join(os.path.dirname(deframed.__file__), cfg.mainpage))
-            with f:
-                data = cfg.data.copy()
-
-                data['debug'] = self.debug
-                data['version'] = self.version
-                if data['title'] == CFG.data.title:
-                    data['title'] = self.worker.title
-
-                return Response(chevron.render(f, data),
-                        headers={"Access-Control-Allow-Origin": "*"})
+            if cfg.mainpage_reload:
+                self._check_mainpage()
+            body, etag = self._render_main()
+            headers = {
+                "Access-Control-Allow-Origin": "*",
+                "Cache-Control": "no-cache",
+                "ETag": etag,
+            }
+            tags = parse_etags(request.headers.get("If-None-Match"))
+            if etag in tags or "*" in tags:
+                return Response("", status=304, headers=headers)
+            return Response(body, headers=headers)
 
         @self.app.websocket('/ws')
         async def ws():
             """Main websocket"""
+            ws = websocket._get_current_object()
+            p = self._owner(websocket.args.get("s"))
+            if p is not None and await relay(ws, self._socket_path(p)):
+                return
             w = self.worker(self)
-            await w.run(websocket._get_current_object())
+            await w.run(ws)
 
         @self.app.route("/sub/<int:sid>", methods=['GET'])
         async def index_sub(sid):
@@ -82,31 +112,187 @@ class App:
             else:
                 await w.run(websocket._get_current_object())
 
-        static = os.path.join(os.path.dirname(deframed.__file__), cfg.data.static)
+        pkg = os.path.dirname(deframed.__file__)
+        self.static = StaticFiles([
+                os.path.join(pkg, cfg.data.static),
+                os.path.join(pkg, "static"),
+            ], cfg.assets)
+        self.static.scan()
+        self._bundle()
+
         @self.app.route("/static/<path:filename>", methods=['GET'])
         async def send_static(filename):
-            print("GET",filename)
-            try:
-                return await send_from_directory(static, filename)
-            except NotFound:
-                return await send_from_directory(os.path.join(os.path.dirname(deframed.__file__),"static"), filename)
+            res = self.static.lookup(filename, request.headers)
+            if res is None:
+                raise NotFound
+            status, body, headers = res
+            return Response(body, status=status, headers=headers)
+
+    def _bundle(self):
+        """
+        Build the client's script and style bundles.
+
+        If the required files have not been downloaded (``make`` does that),
+        the main page loads them from their CDNs instead.
+        """
+        cfg = self.cfg.assets
+        self.bundle_js = self.static.bundle("df.js", cfg.bundle) if cfg.bundle else None
+        self.bundle_css = self.static.bundle("df.css", cfg.bundle_css) if cfg.bundle_css else None
+        self._main_cache = {}
+
+    def _load_zdict(self) -> bytes:
+        """
+        Load or build the dictionary for ``dict`` compression.
+        """
+        cfg = self.cfg.ws
+        if cfg.compress_dict:
+            with open(cfg.compress_dict, "rb") as f:
+                return f.read()
+        samples = list(SAMPLES)
+        for fn in cfg.compress_samples:
+            with open(fn) as f:
+                samples.append(f.read())
+        return train_dictionary(samples)
+
+    def compressor(self, headers) -> Optional[FrameCompressor]:
+        """
+        Returns the frame compressor to use for a new websocket, if any.
+
+        Args:
+          headers: the websocket's request headers.
+        """
+        cfg = self.cfg.ws
+        if not cfg.compress:
+            return None
+        if not cfg.compress_pmd and "permessage-deflate" in headers.get("Sec-WebSocket-Extensions", ""):
+            # the websocket is already compressed
+            return None
+        return FrameCompressor(cfg.compress, self._zdict, cfg.compress_min)
+
+    def _load_mainpage(self):
+        """
+        Read and tokenize the main page's template.
+
+        This also clears the cache of rendered pages.
+        """
+        path = self.cfg.mainpage
+        if not os.path.exists(path):
+            path = os.path.join(os.path.dirname(deframed.__file__), path)
+        with open(path) as f:
+            self._main_mtime = os.fstat(f.fileno()).st_mtime
+            self._main_tokens = list(tokenize(f.read()))
+        self._main_path = path
+        self._main_cache = {}
+
+    def add_template(self, name:str, text:str) -> str:
+        """
+        Register a template for `Worker.render`. Returns its hash.
+        """
+        h = sha1(text.encode("utf-8")).hexdigest()[:16]
+        self._templates[name] = (h, text)
+        self._tpl_hash[h] = text
+        return h
+
+    def template(self, name:str):
+        """
+        Returns a (hash, text) tuple for this template.
+
+        Templates that haven't been added with `add_template` are read
+        from ``NAME`` or ``NAME.mustache`` in the directories listed in
+        the ``templates`` configuration, then in DeFramed's own template
+        directory.
+        """
+        try:
+            return self._templates[name]
+        except KeyError:
+            pass
+        dirs = list(self.cfg.templates)
+        dirs.append(os.path.join(os.path.dirname(deframed.__file__), "templates"))
+        for d in dirs:
+            for fn in (name, name+".mustache"):
+                path = os.path.join(d, fn)
+                if os.path.isfile(path):
+                    with open(path) as f:
+                        self.add_template(name, f.read())
+                    return self._templates[name]
+        raise KeyError(name)
+
+    def template_by_hash(self, h:str) -> Optional[str]:
+        return self._tpl_hash.get(h)
+
+    def _check_mainpage(self):
+        """
+        Re-read the main page's template if it has been modified.
+        """
+        try:
+            mtime = os.stat(self._main_path).st_mtime
+        except OSError:
+            return
+        if mtime != self._main_mtime:
+            logger.debug("Reloading %s", self._main_path)
+            self._load_mainpage()
+
+    def _render_main(self):
+        """
+        Returns the rendered main page and its ETag.
+
+        The result only depends on the version, the debug flag and the
+        title, so it is cached on that.
+        """
+        title = self.cfg.data.title
+        if title == CFG.data.title:
+            title = self.worker.title
+        key = (self.version, self.debug, title, self.bundle_js, self.bundle_css)
+        try:
+            return self._main_cache[key]
+        except KeyError:
+            pass
+
+        data = self.cfg.data.copy()
+        data['debug'] = self.debug
+        data['version'] = self.version
+        data['title'] = title
+        data['bundle_js'] = self.bundle_js
+        data['bundle_css'] = self.bundle_css
+        body = chevron.render(self._main_tokens, data).encode("utf-8")
+        res = self._main_cache[key] = (body, '"%s"' % sha1(body).hexdigest())
+        return res
 
     def route(self,*a,**k):
         return self.app.route(*a,**k)
 
+    def _owner(self, uuid) -> Optional[int]:
+        """
+        The process which owns this session, if it's not us.
+        """
+        if self.process is None:
+            return None
+        p = process_of(uuid, self.processes)
+        if p == self.process:
+            return None
+        return p
+
+    def _socket_path(self, p:int) -> str:
+        return os.path.join(self.socket_dir, "%d.sock" % (p,))
+
 
     async def run (self) -> None:
         """
         Run this application.
 
-        This is a simple Hypercorn runner.
-        You should probably use something more elaborate in a production setting.
+        This is a simple Hypercorn runner. Use `deframed.runner.Runner` to
+        run it in more than one process.
         """
         config = HyperConfig()
         cfg = self.cfg.server
         config.access_log_format = "%(h)s %(r)s %(s)s %(b)s %(D)s"
         config.access_logger = create_serving_logger()  # type: ignore
-        config.bind = [f"{cfg.host}:{cfg.port}"]
+        if self.process is None:
+            config.bind = [f"{cfg.host}:{cfg.port}"]
+        else:
+            # Hypercorn owns the socket from now on
+            sock = self._reuseport_socket()
+            config.bind = [f"fd://{sock.detach()}"]
         config.ca_certs = cfg.ca_certs
         config.certfile = cfg.certfile
 #   if debug is not None:
@@ -118,7 +304,85 @@ class App:
         scheme = "http" if config.ssl_enabled is None else "https"
         async with trio.open_nursery() as n:
             self.main = n
+            await n.start(self.clients.run)
+            if self.process is not None:
+                await n.start(serve_relayed, self, self._socket_path(self.process))
             await hyper_serve(self.app, config)
+            n.cancel_scope.cancel()
+
+    def _reuseport_socket(self):
+        """
+        Create this process's listening socket. All processes bind to the
+        same port; the kernel distributes connections among them.
+        """
+        cfg = self.cfg.server
+        sock = socket.socket(socket.AF_INET6 if ":" in cfg.host else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((cfg.host, cfg.port))
+        return sock
+
+    def join(self, group, worker):
+        """
+        Add a worker to a group, for `broadcast`. Groups are created on
+        demand.
+        """
+        self.groups.setdefault(group, set()).add(worker)
+        worker._groups.add(group)
+
+    def leave(self, group, worker):
+        """
+        Remove a worker from a group. Empty groups are deleted.
+        """
+        worker._groups.discard(group)
+        g = self.groups.get(group)
+        if g is None:
+            return
+        g.discard(worker)
+        if not g:
+            del self.groups[group]
+
+    def broadcast(self, action:str, data:Any=None, *, group=None, filter=None, key=None) -> int:
+        """
+        Send a message to many clients.
+
+        The message is packed once. It is queued to each client without
+        waiting, thus a slow client does not delay the others; see
+        `Talker.offer`.
+
+        ``action`` may also be a `PackedMessage`.
+
+        Args:
+          group:
+            Send to the members of this group. Default: all sessions.
+          filter:
+            A function that's called with each worker. The message is
+            only sent if it returns True.
+          key:
+            Replace a queued message with the same key, as in
+            `Worker.set_content`. Useful for tickers and the like: a
+            client that can't keep up only gets the latest state.
+
+        Returns the number of clients the message was queued for.
+        """
+        if group is None:
+            workers = self.clients.values()
+        else:
+            workers = self.groups.get(group, ())
+        if not isinstance(action, PackedMessage):
+            action = PackedMessage(action, data)
+        msg = action.msg
+        action = action.action
+        n = 0
+        for w in list(workers):
+            t = w._talker
+            if t is None or t._dead:
+                continue
+            if filter is not None and not filter(w):
+                continue
+            if t.offer(action, msg, key):
+                n += 1
+        return n
 
     def attach_sub(self, subworker):
         """
@@ -0,0 +1,177 @@
+"""
+This module contains DeFramed's session registry.
+
+The registry holds a strong reference to every session, so that a client
+which reconnects after a network glitch finds its worker again. Sessions
+are removed ("evicted") when they have been disconnected for longer than a
+grace period, when the client has been idle for too long, or (least
+recently used first) when there are too many of them.
+"""
+
+import time
+import trio
+from collections import OrderedDict
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ["Sessions"]
+
+
+class Sessions:
+    """
+    A mapping of UUID → worker, ordered by the client's last activity.
+
+    Args:
+      cfg:
+        the ``session`` part of the configuration.
+
+    Call `run` in a background task to evict expired sessions.
+    """
+    _nursery = None
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self._s = OrderedDict() # uuid > worker, least recently used first
+        self._active = {} # uuid > time.monotonic of the last activity
+        self._detached = {} # uuid > time.monotonic of the disconnect
+        self.evicted = {} # reason > count
+
+    def __getitem__(self, uuid):
+        return self._s[uuid]
+
+    def get(self, uuid, default=None):
+        return self._s.get(uuid, default)
+
+    def __contains__(self, uuid):
+        return uuid in self._s
+
+    def __len__(self):
+        return len(self._s)
+
+    def __iter__(self):
+        return iter(self._s)
+
+    def values(self):
+        return self._s.values()
+
+    def __setitem__(self, uuid, worker):
+        self._s[uuid] = worker
+        self._s.move_to_end(uuid)
+        self._active[uuid] = time.monotonic()
+        if self.cfg.max_sessions:
+            while len(self._s) > self.cfg.max_sessions:
+                self.evict(self._lru(), "count")
+
+    def __delitem__(self, uuid):
+        del self._s[uuid]
+        del self._active[uuid]
+        self._detached.pop(uuid, None)
+
+    def touch(self, uuid):
+        """
+        The client has sent something.
+        """
+        try:
+            self._s.move_to_end(uuid)
+        except KeyError:
+            return
+        self._active[uuid] = time.monotonic()
+
+    def attach(self, worker):
+        """
+        The worker has a websocket again.
+        """
+        self._detached.pop(worker.uuid, None)
+        self.touch(worker.uuid)
+
+    def detach(self, worker):
+        """
+        The worker's websocket has disconnected. Start the grace period.
+        """
+        if worker.uuid in self._s:
+            self._detached[worker.uuid] = time.monotonic()
+
+    def _lru(self):
+        """
+        The least recently used session. Detached sessions go first.
+        """
+        for uuid in self._s:
+            if uuid in self._detached:
+                return self._s[uuid]
+        return next(iter(self._s.values()))
+
+    def evict(self, worker, reason: str):
+        """
+        Remove this worker, and tell it so by calling its ``evicted``
+        method. Does nothing if the worker has already been removed.
+        """
+        if self._s.get(worker.uuid) is not worker:
+            return
+        del self[worker.uuid]
+        worker.leave()
+        self.evicted[reason] = self.evicted.get(reason, 0) + 1
+        logger.debug("Evict %s: %s", worker.uuid, reason)
+        worker.cancel()
+        if worker._talker is not None:
+            worker._talker.cancel()
+        if self._nursery is not None:
+            self._nursery.start_soon(self._evicted, worker, reason)
+
+    @staticmethod
+    async def _evicted(worker, reason):
+        try:
+            await worker.evicted(reason)
+        except Exception:
+            logger.exception("Evicting %s", worker.uuid)
+
+    def expire(self, now: Optional[float] = None):
+        """
+        Evict sessions whose grace period or idle time has run out, then
+        evict the least recently used ones until the configured limits are
+        met.
+        """
+        cfg = self.cfg
+        if now is None:
+            now = time.monotonic()
+        if cfg.grace is not None:
+            for uuid, t in list(self._detached.items()):
+                if t+cfg.grace <= now:
+                    self.evict(self._s[uuid], "grace")
+        if cfg.idle:
+            for uuid in list(self._s):
+                if self._active[uuid]+cfg.idle > now:
+                    break # the rest has been active more recently
+                self.evict(self._s[uuid], "idle")
+        if cfg.max_bytes:
+            size = sum(w.memory() for w in self._s.values())
+            while self._s and size > cfg.max_bytes:
+                w = self._lru()
+                size -= w.memory()
+                self.evict(w, "memory")
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED):
+        """
+        Periodically evict expired sessions.
+        """
+        async with trio.open_nursery() as n:
+            self._nursery = n
+            task_status.started()
+            try:
+                while True:
+                    await trio.sleep(self.cfg.sweep)
+                    self.expire()
+            finally:
+                self._nursery = None
+
+    def stats(self) -> dict:
+        """
+        Returns the number of ``live`` and ``detached`` sessions, and how
+        many were ``evicted`` (a dict of reason → count).
+        """
+        return dict(
+            live=len(self._s)-len(self._detached),
+            detached=len(self._detached),
+            evicted=dict(self.evicted),
+        )
@@ -26,12 +26,15 @@ var DeFramed = function(){
 	if (this.token === undefined || this.token == "undefined") this.token = null;
 	this.version = null;
 	this.backoff = 100;
+	this.seq = 0; // number of frames processed, for resuming
 	this.debug = sessionStorage.getItem('debug');
 	this.reconnect_timer = null;
 	this._setupListeners();
 	this.vars = { _: window };
 
 	this.iframes = {};
+	this.templates = {}; // hash > template, backed by localStorage
+	this.tpl_wait = {}; // hash > renders waiting for the template
 
 	if (window.DF_parent_uuid) {
 		this.parent = window.parent;
@@ -150,9 +153,15 @@ DeFramed.prototype.reconnect = function(){
 DeFramed.prototype._setupWebsocket = function(){
 	let self = this;
 	var url = window.location.protocol.replace('http', 'ws') + '//' + window.location.host + '/ws';
+	if (this.uuid) url += "?s=" + this.uuid; // find our session's server process
 	this.ws = new WebSocket(url);
 	this.ws.binaryType = 'arraybuffer';
 	this.has_error = false;
+	this.rx_bytes = 0;
+	if (this.ack_timer) {
+		clearTimeout(this.ack_timer);
+		this.ack_timer = null;
+	}
 	if (this.debug) console.log("WS START",url);
 
 	this.ws.onclose = function(event){
@@ -177,14 +186,24 @@ DeFramed.prototype._setupWebsocket = function(){
 		var m = self.msg_decode(event.data);
 		var action = m[0];
 		m = m[1];
+		if (action != "zdict") self.seq += 1;
 		self._dispatch(action,m);
+
+		// tell the server how much we've processed, once per burst
+		self.rx_bytes += event.data.byteLength;
+		if (!self.ack_timer) {
+			self.ack_timer = setTimeout(function() {
+				self.ack_timer = null;
+				self.send("ack", [self.rx_bytes, self.seq]);
+			}, 0);
+		}
 	};
 		
 
 	this.ws.onopen = function (msg) {
 		$("#df_spinner").show();
 		self.announce("danger");
-		self.send("setup", {"uuid":self.uuid, "token":self.token, "version":window.deframed_version});
+		self.send("setup", {"uuid":self.uuid, "token":self.token, "version":window.deframed_version, "seq":self.seq, "templates":self._stored_templates()});
 		self.announce("info",'Talking to the server. Stand by.');
 	};
 };
@@ -205,6 +224,23 @@ DeFramed.prototype._dispatch = function(action,m) {
 	}
 };
 
+DeFramed.prototype.msg_zdict = function(m) {
+	this.zdict = m;
+};
+
+DeFramed.prototype.msg_z = function(m) {
+	var opts = {};
+	if (this.zdict) opts.dictionary = this.zdict;
+	m = this.msg_decode(pako.inflateRaw(m, opts));
+	this._dispatch(m[0],m[1]);
+};
+
+DeFramed.prototype.msg_batch = function(m) {
+	for (var x of m) {
+		this._dispatch(x[0],x[1]);
+	}
+};
+
 DeFramed.prototype.send = function(action,data) {
 	if (this.debug) console.log("OUT",action,data);
 	if(action == "reply") {
@@ -356,20 +392,102 @@ DeFramed.prototype.req_token = function(m) {
 	return t;
 }
 
-DeFramed.prototype.req_elem_info = function(m) {
-	var e = document.getElementById(m);
+DeFramed.prototype._elem_facts = function(e, facts, attrs) {
 	if (e === null)
 		return null;
-	return { 'height':e.scrollHeight
-			, 'width':e.scrollWidth
-			, 'view':e.getBoundingClientRect().toJSON()
-			};
+	var r = {};
+	for (var f of facts) {
+		if (f == "attrs") {
+			var a = {};
+			if (attrs) {
+				for (var n of attrs)
+					a[n] = e.getAttribute(n);
+			} else {
+				for (var i = 0; i < e.attributes.length; i++)
+					a[e.attributes[i].name] = e.attributes[i].value;
+			}
+			r.attrs = a;
+		} else if (f == "box") {
+			r.box = e.getBoundingClientRect().toJSON();
+		} else if (f == "scroll") {
+			r.scroll = { 'height':e.scrollHeight, 'width':e.scrollWidth
+					   , 'top':e.scrollTop, 'left':e.scrollLeft };
+		} else if (f == "value") {
+			r.value = (e.value === undefined) ? null : e.value;
+		} else if (f == "checked") {
+			r.checked = (e.checked === undefined) ? null : e.checked;
+		}
+	}
+	return r;
+}
+
+DeFramed.prototype.req_query = function(m) {
+	var res = { 'ids':[], 'sel':[] };
+	for (var id of m.ids)
+		res.ids.push(this._elem_facts(document.getElementById(id), m.facts, m.attrs));
+	for (var sel of m.sel)
+		res.sel.push(this._elem_facts(document.querySelector(sel), m.facts, m.attrs));
+	return res;
 }
 
 DeFramed.prototype.msg_ping = function(m) {
 	this.send("pong",m);
 }
 
+DeFramed.prototype._stored_templates = function() {
+	var res = [];
+	try {
+		for (var i = 0; i < localStorage.length; i++) {
+			var k = localStorage.key(i);
+			if (k.startsWith("df_tpl:")) res.push(k.substr(7));
+		}
+	} catch(e) {}
+	return res;
+}
+
+DeFramed.prototype._template = function(h) {
+	var t = this.templates[h];
+	if (t === undefined) {
+		try { t = localStorage.getItem("df_tpl:"+h); } catch(e) { t = null; }
+		if (t === null) return undefined;
+		this.templates[h] = t;
+	}
+	return t;
+}
+
+DeFramed.prototype.msg_tpl = function(m) { // hash text
+	this.templates[m[0]] = m[1];
+	try {
+		localStorage.setItem("df_tpl:"+m[0], m[1]);
+	} catch(e) {
+		if (this.debug) console.log("Template not stored",e);
+	}
+	var w = this.tpl_wait[m[0]];
+	if (w !== undefined) {
+		delete this.tpl_wait[m[0]];
+		for (var r of w)
+			this.msg_render(r);
+	}
+}
+
+DeFramed.prototype.msg_render = function(m) { // id hash data
+	var t = this._template(m[1]);
+	if (t === undefined) {
+		// not stored, or removed from storage: ask for it
+		var w = this.tpl_wait[m[1]];
+		if (w === undefined) {
+			this.tpl_wait[m[1]] = [m];
+			this.send("template", m[1]);
+		} else {
+			w.push(m);
+		}
+		return;
+	}
+	var e = document.getElementById(m[0]);
+	if (e !== null)
+		e.innerHTML = Mustache.render(t, m[2]);
+}
+
 DeFramed.prototype.msg_set = function(m) {
 	var id = "#"+m[0]
 	var pre = m[2]
@@ -383,27 +501,6 @@ DeFramed.prototype.msg_set = function(m) {
 		$(id).html(m);
 }
 
-DeFramed.prototype.req_get_attr = function(m) {
-	res = []
-
-	Object.keys(m).forEach(k => {
-		var v = m[k];
-		var e = document.getElementById(k);
-		if (e === undefined)
-			res.push(null);
-		else if(!e.hasAttributes)
-			res.push({});
-		else {
-			var r = {};
-			var attrs = e.attributes;
-			for(var i = attrs.length - 1; i >= 0; i--) 
-				r[attrs[i].name] = attrs[i].value;
-			res[k] = r;
-		}
-	});
-	return res;
-}
-
 DeFramed.prototype._augmentInterface = function(){
 	var tags = document.getElementsByTagName('BUTTON');
 	for(var i = 0; i < tags.length; i++){
@@ -449,38 +546,139 @@ DeFramed.prototype._elementActivated = function(action,ele){
 	this.send(action, this._getActionURL(ele));
 };
 
-DeFramed.prototype.msg_elem = function(m) {
-	var elem = document.getElementById(m[0]);
-	m = m[1];
-	var focusedElement=null;
-	var caretStart=-1;
-	var caretEnd=-1;
+DeFramed.prototype._save_focus = function() {
+	var f = {id:null, start:-1, end:-1};
 	if (document.activeElement) {
-		focusedElement = document.activeElement.id;
+		f.id = document.activeElement.id;
 		try {
-			caretStart = document.activeElement.selectionStart;
-			caretEnd = document.activeElement.selectionEnd;
+			f.start = document.activeElement.selectionStart;
+			f.end = document.activeElement.selectionEnd;
 		} catch(e) {}
 	}
+	return f;
+}
+
+DeFramed.prototype._restore_focus = function(f) {
+	if (f.id) {
+		var elemToFocus = document.getElementById(f.id);
+		if (elemToFocus != null) {
+			elemToFocus.focus();
+			try {
+				elemToFocus = document.getElementById(f.id);
+				if(f.start>-1 && f.end>-1) elemToFocus.setSelectionRange(f.start, f.end);
+			} catch(e) {}
+		}
+	}
+}
+
+DeFramed.prototype._replace_elem = function(id, html) {
+	var elem = document.getElementById(id);
+	if (elem === null) {
+		if (this.debug) console.log("no element",id);
+		return;
+	}
 	//try {
-		elem.insertAdjacentHTML('afterend',m);
+		elem.insertAdjacentHTML('afterend',html);
 		elem.parentElement.removeChild(elem);
 	//} catch(e) {
 		///*Microsoft EDGE doesn't support insertAdjacentHTML for SVGElement*/
 		//var ns = document.createElementNS("http://www.w3.org/2000/svg",'tmp');
-		//ns.innerHTML = m;
+		//ns.innerHTML = html;
 		//elem.parentElement.replaceChild(ns.firstChild, elem);
 	//}
+}
 
-	if (focusedElement) {
-		var elemToFocus = document.getElementById(focusedElement);
-		if (elemToFocus != null) {
-			elemToFocus.focus();
-			try {
-				elemToFocus = document.getElementById(focusedElement);
-				if(caretStart>-1 && caretEnd>-1) elemToFocus.setSelectionRange(caretStart, caretEnd);
-			} catch(e) {}
+DeFramed.prototype.msg_elem = function(m) {
+	var f = this._save_focus();
+	this._replace_elem(m[0], m[1]);
+	this._restore_focus(f);
+}
+
+DeFramed.prototype._modify_elem = function(id, attrs, style, content) {
+	var elem = document.getElementById(id);
+	if (elem === null) {
+		if (this.debug) console.log("no element",id);
+		return;
+	}
+	for (var k in attrs) {
+		if (attrs[k] === null) elem.removeAttribute(k);
+		else elem.setAttribute(k, attrs[k]);
+	}
+	for (var k in style) {
+		if (style[k] === null) elem.style.removeProperty(k);
+		else elem.style.setProperty(k, style[k]);
+	}
+	if (content !== null) elem.innerHTML = content;
+}
+
+DeFramed.prototype.msg_elems = function(m) { // [[id,html] or [id,attrs,style,content],…]
+	var f = this._save_focus();
+	for (var x of m) {
+		if (x.length == 2) this._replace_elem(x[0], x[1]);
+		else this._modify_elem(x[0], x[1], x[2], x[3]);
+	}
+	this._restore_focus(f);
+}
+
+DeFramed.prototype._fragment = function(html) {
+	var t = document.createElement("template");
+	t.innerHTML = html;
+	return t.content;
+}
+
+DeFramed.prototype._patch_node = function(base, elem, path, tag) {
+	var n = base;
+	var i = 0;
+	if (elem) { // the element itself is the virtual root's only child
+		if (path[0] !== 0) throw "bad path";
+		i = 1;
+	}
+	for (; i < path.length; i++) {
+		n = n.childNodes[path[i]];
+		if (n === undefined) throw "bad path";
+	}
+	if (tag && n.nodeName.toLowerCase() != tag) throw "bad tag";
+	return n;
+}
+
+DeFramed.prototype.msg_patch = function(m) { // mode id patches
+	var base = document.getElementById(m[1]);
+	var elem = (m[0] == "elem");
+	try {
+		if (base === null) throw "no element";
+		for (var p of m[2]) {
+			var n;
+			if (p[0] == "t") {
+				n = this._patch_node(base, elem, p[1]);
+				if (n.nodeType != Node.TEXT_NODE) throw "not text";
+				n.nodeValue = p[2];
+			} else if (p[0] == "a") {
+				n = this._patch_node(base, elem, p[1], p[2]);
+				for (var k in p[3]) {
+					if (p[3][k] === null) n.removeAttribute(k);
+					else n.setAttribute(k, p[3][k]);
+				}
+			} else if (p[0] == "r") {
+				n = this._patch_node(base, elem, p[1], p[2]);
+				n.replaceWith(this._fragment(p[3]));
+				if (elem && p[1].length == 1) base = document.getElementById(m[1]);
+			} else if (p[0] == "i") {
+				n = this._patch_node(base, elem, p[1], p[2]);
+				var ref = n.childNodes[p[3]];
+				if (ref === undefined && p[3] != n.childNodes.length) throw "bad index";
+				n.insertBefore(this._fragment(p[4]), ref || null);
+			} else if (p[0] == "d") {
+				n = this._patch_node(base, elem, p[1], p[2]);
+				if (n.childNodes.length < p[3]+p[4]) throw "bad index";
+				for (var i = 0; i < p[4]; i++)
+					n.removeChild(n.childNodes[p[3]]);
+			} else {
+				throw "unknown patch";
+			}
 		}
+	} catch(e) {
+		if (this.debug) console.log("Patch failed",m,e);
+		this.send("patch_fail", [m[0], m[1]]);
 	}
 }
 
@@ -0,0 +1,68 @@
+"""
+This module contains DeFramed's wire tracing.
+
+Each traced session keeps a ring buffer with the last few frames that went
+over its websocket. Only metadata is kept, not the content, so tracing is
+cheap enough to leave on for a sample of production sessions.
+"""
+
+import time
+import random
+from collections import deque
+from pprint import pformat
+from typing import Optional
+
+__all__ = ["WireTrace", "LazyFormat"]
+
+
+class LazyFormat:
+    """
+    Pretty-print some data, but only when a logger actually wants it::
+
+        logger.debug("IN %s", LazyFormat(data))
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return pformat(self.data)
+
+
+class WireTrace:
+    """
+    A ring buffer of the last ``size`` frames.
+
+    Each entry is a ``(timestamp, direction, action, size)`` tuple;
+    direction is ``"in"`` or ``"out"``.
+    """
+    def __init__(self, size: int):
+        self.buf = deque(maxlen=size)
+
+    @classmethod
+    def sampled(cls, cfg) -> Optional["WireTrace"]:
+        """
+        Returns a new trace buffer for a fraction ``cfg.sample`` of
+        sessions, `None` for the others.
+        """
+        if not cfg.size or not cfg.sample:
+            return None
+        if cfg.sample < 1 and random.random() >= cfg.sample:
+            return None
+        return cls(cfg.size)
+
+    def add(self, direction: str, action: str, size: int):
+        self.buf.append((time.time(), direction, action, size))
+
+    def dump(self) -> str:
+        """
+        Returns the buffer's content, one frame per line.
+        """
+        return "\n".join(
+            "%s.%03d %-3s %6d %s" % (time.strftime("%H:%M:%S", time.localtime(ts)),
+                int(ts*1000)%1000, direction, size, action)
+            for ts, direction, action, size in self.buf)
+
+    def __len__(self):
+        return len(self.buf)
@@ -5,26 +5,76 @@ communication with the client.
 
 from uuid import uuid1,UUID
 import trio
+import math
+from collections import deque
 from collections.abc import Mapping
 from typing import Optional,Dict,List,Union,Any
 from .util import packer, unpacker, Proxy
-from functools import partial
-from pprint import pformat
+from .trace import WireTrace, LazyFormat
+from . import diff as _diff
+from contextlib import asynccontextmanager
 
 from contextvars import ContextVar
 processing = ContextVar("processing", default=None)
+batching = ContextVar("batching", default=None)
 
 import logging
 logger = logging.getLogger(__name__)
 
 async def _spawn(task, *args, task_status=trio.TASK_STATUS_IGNORED):
     processing.set(None)
+    batching.set(None) # the spawner's batch is sent without waiting for us
 
     with trio.CancelScope() as sc:
         task_status.started(sc)
         await task(*args)
 
 
+async def run_ordered(recv, proc, key, concurrency: int, limit: int = None):
+    """
+    Call ``proc`` on each item read from the channel ``recv``, up to
+    ``concurrency`` of them in parallel. Items for which ``key`` returns
+    the same value are processed in order.
+
+    If ``limit`` is set, at most that many items are queued or running;
+    the next item is read only when one of them is done, so that senders
+    block instead of piling up work.
+    """
+    if limit is not None:
+        limit = trio.Semaphore(limit, max_value=limit)
+    limiter = trio.CapacityLimiter(concurrency)
+    queues = {} # key > deque of items
+
+    async def run_key(k, q):
+        try:
+            while q:
+                try:
+                    async with limiter:
+                        await proc(q[0])
+                finally:
+                    q.popleft()
+                    if limit is not None:
+                        limit.release()
+        finally:
+            del queues[k]
+
+    async with trio.open_nursery() as n:
+        while True:
+            if limit is not None:
+                await limit.acquire()
+            try:
+                item = await recv.receive()
+            except trio.EndOfChannel:
+                return
+            k = key(item)
+            q = queues.get(k)
+            if q is not None:
+                q.append(item)
+            else:
+                q = queues[k] = deque((item,))
+                n.start_soon(run_key, k, q)
+
+
 class UnknownActionError(RuntimeError):
     """
     The client sent a message which I don't understand.
@@ -32,6 +82,45 @@ class UnknownActionError(RuntimeError):
     pass
 
 
+def _on(kind, name):
+    def deco(proc):
+        h = proc.__dict__.setdefault("_df_handler", [])
+        h.append((kind, name))
+        return proc
+    return deco
+
+def on_msg(name):
+    """
+    Decorator to declare a `Worker` method as the handler for client
+    messages with this action, in addition to (or instead of) naming it
+    ``msg_{name}``.
+    """
+    return _on("msg", name)
+
+def on_button(name):
+    """
+    Decorator to declare a `Worker` method as the handler for the button
+    with this ID, in addition to (or instead of) naming it
+    ``button_{name}``.
+    """
+    return _on("button", name)
+
+def on_form(name):
+    """
+    Decorator to declare a `Worker` method as the handler for the form
+    with this ID, in addition to (or instead of) naming it
+    ``form_{name}``.
+    """
+    return _on("form", name)
+
+
+class DisconnectedError(RuntimeError):
+    """
+    The client disconnected while a request was pending.
+    """
+    pass
+
+
 class ClientError(RuntimeError):
     def __init__(self, _error, **kw):
         self.error = _error
@@ -53,17 +142,126 @@ class ClientError(RuntimeError):
 
 _talk_id = 0
 
+def _array_header(n: int) -> bytes:
+    """
+    Returns the msgpack header of an array with ``n`` elements.
+    """
+    if n < 16:
+        return bytes((0x90|n,))
+    if n < 0x10000:
+        return b"\xdc" + n.to_bytes(2,"big")
+    return b"\xdd" + n.to_bytes(4,"big")
+
+_BATCH = _array_header(2) + packer("batch")
+
+
+class PackedMessage:
+    """
+    A message that's packed once and can then be sent any number of
+    times, to any number of clients::
+
+        NAVBAR = PackedMessage("set", ["nav", NAV_HTML, None])
+
+        await worker.send(NAVBAR)
+        app.broadcast(NAVBAR)
+
+    Packing happens when the message is first used. Arguments are as
+    for `Worker.send`.
+    """
+    __slots__ = ("action", "data", "_msg")
+
+    def __init__(self, action:str, data:Any=None, **kw):
+        if action == "req":
+            raise RuntimeError("Requests can't be pre-packed")
+        if kw:
+            if data:
+                data = dict(data, **kw)
+            else:
+                data = kw
+        self.action = action
+        self.data = data
+        self._msg = None
+
+    @property
+    def msg(self) -> bytes:
+        if self._msg is None:
+            self._msg = packer([self.action, self.data])
+        return self._msg
+
+    def __getitem__(self, i):
+        # so that it looks like a message, for logging and such
+        return (self.action, self.data)[i]
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.action)
+
+
+class _Entry:
+    """
+    A queued message, already packed. ``count`` is the number of
+    messages in ``msg``, which is more than one for batches.
+    """
+    __slots__ = ("key","action","msg","count")
+
+    def __init__(self, key, action, msg, count=1):
+        self.key = key
+        self.action = action
+        self.msg = msg
+        self.count = count
+
+
 class Talker:
     """
     This class encapsulates the client's websocket connection.
 
     It is instantiated by the server. You probably should not touch it.
+
+    Outgoing messages are packed when they are queued. The client
+    acknowledges the bytes it has processed; no more than ``window``
+    unacknowledged bytes are sent.
     """
     w = None # Worker
     _scope = None
-
-    def __init__(self, websocket):
+    _nursery = None
+    trace = None # WireTrace
+    _not_full = None
+    _window_open = None
+    _in_ready = None
+    _in_room = None
+    _dead = False
+    _successor = None # the talker that took over our queue, see `adopt`
+    overflow = "block"
+
+    def __init__(self, websocket, cfg, compressor=None):
         self.ws = websocket
+        self.compressor = compressor
+        self.batch_max = cfg.batch_max
+        self.batch_delay = cfg.batch_delay
+        self.queue_len = cfg.queue_len
+        self.in_queue_len = cfg.in_queue_len
+        self.queue_bytes = cfg.queue_bytes
+        self.window = cfg.window
+        self.frames_out = 0
+        self.msgs_out = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.lost = 0 # dropped while the client was away; it needs a refresh
+        self.stall_time = 0.0
+        self.bytes_out = 0
+        self.bytes_acked = 0
+
+        # The send queue. Entries can be replaced while they're still
+        # queued, if they have a key.
+        self._q = deque()
+        self._q_bytes = 0
+        self._keyed = {} # key > queue entry
+        self._pending = {} # key > entry that waits for room in the queue
+        self._later = deque() # unkeyed entries from `offer` that wait, too
+        self._delayed = {} # key > entry, for rate limiting
+        self._last_sent = {} # key > trio.current_time
+        self._not_empty = trio.Event()
+        self._attached = trio.Event()
+        self._in = deque() # incoming messages, for `_handle_in`
 
         global _talk_id
         self._id = _talk_id
@@ -81,10 +279,17 @@ class Talker:
         try:
             async with trio.open_nursery() as n:
                 self._scope = n.cancel_scope
+                self._nursery = n
                 await n.start(self.ws_in)
                 await n.start(self.ws_out)
                 task_status.started()
         finally:
+            logger.debug("END %d: %d messages in %d frames", self._id, self.msgs_out, self.frames_out)
+            self._dead = True
+            self._nursery = None
+            if self._not_full is not None:
+                self._not_full.set()
+                self._not_full = None
             with trio.fail_after(2) as sc:
                 sc.shield=True
                 if self.w is not None:
@@ -102,7 +307,8 @@ class Talker:
             s.shield = True
             try:
                 if self.w:
-                    await self._send(["info",dict(level="warning", text=msg)])
+                    # The client counts this frame, so we must, too.
+                    await self._send(_Entry(None, "info", packer(["info",dict(level="warning", text=msg)])))
             except Exception:
                 logger.exception("Terminal message")
                 pass
@@ -117,53 +323,435 @@ class Talker:
         Attach this websocket to an existing worker. Used when a client
         reconnects and presents an existing session ID.
         """
-        if isinstance(self.w, trio.Event):
-            self.w.set()
         self.w = worker
+        self.trace = worker.trace
+        self.overflow = worker.overflow
+        self._attached.set()
+
+    def adopt(self, old):
+        """
+        Take over the messages that the worker's previous talker didn't
+        get to send, usually because the client was disconnected. They
+        are queued in front of ours.
+
+        Requests are left out; the worker fails them when it re-attaches.
+        """
+        entries = list(old._q) + list(old._delayed.values()) + \
+                list(old._pending.values()) + list(old._later)
+        old._q.clear()
+        old._q_bytes = 0
+        old._keyed.clear()
+        old._delayed.clear()
+        old._pending.clear()
+        old._later.clear()
+        old._successor = self
+        self.lost += old.lost
+        old.lost = 0
+        # wake up senders that wait for room in the old queue
+        if old._not_full is not None:
+            old._not_full.set()
+            old._not_full = None
+
+        self._put_first([e for e in entries if e.action != "req" and
+            (e.key is None or (e.key not in self._keyed and e.key not in
+                self._pending and e.key not in self._delayed))])
 
     async def ws_in(self, *, task_status=trio.TASK_STATUS_IGNORED):
         """
         Background task for reading from the web socket.
+
+        Acknowledgements and replies are processed here. Everything else
+        is queued for the worker, so that a slow handler doesn't block
+        them.
+
+        If ``in_queue_len`` messages are queued, reading stops until the
+        worker catches up; except when we wait for the client to
+        acknowledge data. The handler might wait for that too, and the
+        acknowledgement is somewhere in the next messages.
         """
         task_status.started()
-        if isinstance(self.w, trio.Event):
-            await self.w.wait()
+        await self._attached.wait()
+        in_q, in_r = trio.open_memory_channel(0)
+        async with trio.open_nursery() as n:
+            n.start_soon(self._handle_in, in_r)
+            n.start_soon(self._feed_in, in_q)
+            while True:
+                msg = await self.ws.receive()
+                try:
+                    data = unpacker(msg)
+                except TypeError:
+                    logger.error("IN X %r",msg)
+                    raise
+                logger.debug("IN %s",LazyFormat(data))
+                if self.trace is not None:
+                    self.trace.add("in", data[0], len(msg))
+                # Anything counts as activity, including acks: a client
+                # that just watches is not idle.
+                self.w._app.clients.touch(self.w.uuid)
+                if data[0] == "ack":
+                    self._ack(data[1])
+                    continue
+                if data[0] == "reply":
+                    self.w.reply_in(*data[1])
+                    continue
+                self._in.append(data)
+                if self._in_ready is not None:
+                    self._in_ready.set()
+                while len(self._in) >= self.in_queue_len and self._window_open is None:
+                    self._in_room = trio.Event()
+                    await self._in_room.wait()
+
+    async def _feed_in(self, in_q):
+        """
+        Hand the incoming messages to `_handle_in`.
+        """
         while True:
-            data = await self.ws.receive()
-            try:
-                data = unpacker(data)
-            except TypeError:
-                logger.error("IN X %r",data)
-                raise
-            logger.debug("IN %s",pformat(data))
-            await self.w.data_in(data)
+            while not self._in:
+                self._in_ready = trio.Event()
+                await self._in_ready.wait()
+            await in_q.send(self._in.popleft())
+            if self._in_room is not None:
+                self._in_room.set()
+
+    async def _handle_in(self, in_r):
+        """
+        Feed incoming messages to the worker.
+
+        If the worker's ``concurrency`` is larger than one, messages are
+        processed in parallel, except that messages with the same
+        `BaseWorker.order_key` are processed in order. At most
+        ``in_queue_len`` of them are queued or running; after that, the
+        reader waits.
+        """
+        if self.w.concurrency <= 1:
+            async for data in in_r:
+                await self.w.data_in(data)
+            return
+
+        await run_ordered(in_r, self.w.data_in, lambda data: self.w.order_key(*data),
+            self.w.concurrency, self.in_queue_len)
+
+    def _ack(self, data):
+        """
+        The client has processed ``n`` bytes, up to frame number ``seq``.
+        """
+        n, seq = data
+        self.w._acked(seq)
+        if n > self.bytes_acked:
+            self.bytes_acked = n
+            if self._window_open is not None:
+                self._window_open.set()
 
     async def ws_out(self, *, task_status=trio.TASK_STATUS_IGNORED):
         """
-        Background task for sending to the web socket
+        Background task for sending to the web socket.
+
+        Messages which are ready to be sent are collected into a single
+        ``batch`` frame, up to ``batch_max`` of them. If ``batch_delay``
+        is set, wait that long for more messages before sending.
         """
-        self._send_q, send_q = trio.open_memory_channel(10)
         task_status.started()
-        if isinstance(self.w, trio.Event):
-            await self.w.wait()
+        await self._attached.wait()
+        if self.compressor is not None:
+            msg = self.compressor.setup_msg()
+            if msg is not None:
+                # The client can't inflate anything before it has the
+                # dictionary. It doesn't count this frame, nor do we.
+                await self._send(_Entry(None, "zdict", msg), replay=False, compress=False)
+        q = self._q
         while True:
-            data = await send_q.receive()
-            await self._send(data)
-
-    async def _send(self, data):
+            while not q:
+                self._not_empty = trio.Event()
+                await self._not_empty.wait()
+            if self.window and self.bytes_out-self.bytes_acked >= self.window:
+                t = trio.current_time()
+                while self.bytes_out-self.bytes_acked >= self.window:
+                    self._window_open = trio.Event()
+                    if self._in_room is not None:
+                        self._in_room.set() # read on, for the ack
+                    await self._window_open.wait()
+                self._window_open = None
+                self.stall_time += trio.current_time()-t
+            if self.batch_delay:
+                await trio.sleep(self.batch_delay)
+            msgs = []
+            n = 0
+            while q and n < self.batch_max:
+                e = q.popleft()
+                self._q_bytes -= len(e.msg)
+                if e.key is not None:
+                    del self._keyed[e.key]
+                    if e.key in self._last_sent:
+                        self._last_sent[e.key] = trio.current_time()
+                msgs.append(e)
+                n += e.count
+            while self._pending and not self._full():
+                self._put(self._pending.pop(next(iter(self._pending))))
+            while self._later and not self._full():
+                self._put(self._later.popleft())
+            if self._not_full is not None:
+                self._not_full.set()
+                self._not_full = None
+            await self._send_batch(msgs, n)
+
+    async def _send_batch(self, msgs, n):
+        if not msgs:
+            return
+        self.msgs_out += n
+        if n == 1:
+            await self._send(msgs[0])
+        else:
+            msg = b"".join([_BATCH,_array_header(n)] + [e.msg for e in msgs])
+            await self._send(_Entry(None, "batch:%d" % n, msg, n))
+
+    async def _send(self, e, replay=True, compress=True):
+        if replay:
+            self.w._sent(e)
+        msg = e.msg
+        if compress and self.compressor is not None:
+            msg = self.compressor.compress(msg)
+        if self.trace is not None:
+            self.trace.add("out", e.action, len(msg))
+        await self.ws.send(msg)
+        self.frames_out += 1
+        self.bytes_out += len(msg)
+
+    @staticmethod
+    def _pack(data):
+        if isinstance(data, PackedMessage):
+            logger.debug("OUT %r", data)
+            return data.msg
         try:
             msg = packer(data)
         except TypeError:
-            logger.exception("OUT F %s", pformat(data))
+            logger.exception("OUT F %s", LazyFormat(data))
             raise
-        logger.debug("OUT %s", pformat(data))
-        await self.ws.send(msg)
+        logger.debug("OUT %s", LazyFormat(data))
+        return msg
 
-    async def send(self, data:Any):
+    async def send(self, data:Any, key=None, interval:float=None):
         """
         Send a message to the client.
+
+        Args:
+          data:
+            the message, or a `PackedMessage`.
+          key:
+            If a message with the same key is still queued, it is dropped,
+            and this one is queued at the end.
+          interval:
+            Don't send messages with this key more often than that (in
+            seconds). Requires a key.
+        """
+        await self._enqueue(_Entry(key, data[0], self._pack(data)), interval)
+
+    async def send_many(self, data:List, key=None, interval:float=None):
+        """
+        Send a list of messages to the client, in the same frame.
+
+        ``key`` and ``interval`` work as in `send`.
+        """
+        msg = b"".join(self._pack(d) for d in data)
+        await self._enqueue(_Entry(key, "batch", msg, len(data)), interval)
+
+    async def _enqueue(self, e, interval=None):
+        if self._successor is not None:
+            await self._successor._enqueue(e, interval)
+            return
+        if self._try_enqueue(e, interval):
+            return
+        if e.key is not None:
+            # Later messages with this key replace it while we wait.
+            # `ws_out` queues it when there's room, or `adopt` takes it.
+            self._pending[e.key] = e
+            while self._pending.get(e.key) is e:
+                await self._wait_not_full()
+            return
+        # Try again after each wakeup: the policy might drop this.
+        while True:
+            await self._wait_not_full()
+            if self._successor is not None:
+                # The client reconnected while we waited.
+                break
+            if self._try_enqueue(e, interval):
+                return
+        await self._successor._enqueue(e, interval)
+
+    async def _wait_not_full(self):
+        if self._not_full is None:
+            self._not_full = trio.Event()
+        await self._not_full.wait()
+
+    def _try_enqueue(self, e, interval=None) -> bool:
+        """
+        Queue an entry, if that's possible without waiting.
+
+        Returns False if the queue is full and the overflow policy says
+        to block.
+
+        After the connection is gone, messages are still queued, so that
+        `adopt` can hand them to the client's next connection. Those that
+        the policy doesn't allow to block for are counted as ``lost``.
+        """
+        key = e.key
+        if key is not None:
+            if key in self._delayed:
+                self._delayed[key] = e
+                self.coalesced += 1
+                return True
+            old = self._pending.get(key)
+            if old is not None:
+                old.msg = e.msg
+                old.count = e.count
+                self.coalesced += 1
+                return True
+            old = self._keyed.get(key)
+            if old is not None:
+                # Drop the old one. The new one goes to the end: messages
+                # queued in between might depend on the old content.
+                self._q.remove(old)
+                self._q_bytes -= len(old.msg)
+                self._put(e)
+                self.coalesced += 1
+                return True
+            if interval:
+                last = self._last_sent.setdefault(key, -interval)
+                now = trio.current_time()
+                if last+interval > now and self._nursery is not None:
+                    self._delayed[key] = e
+                    self._nursery.start_soon(self._send_later, key, last+interval)
+                    return True
+
+        size = len(e.msg)
+        if self._full(size) and not (key is not None and self.overflow == "coalesce"):
+            if self.overflow == "drop_oldest":
+                self._drop(size)
+            elif self.overflow == "disconnect":
+                if not self._dead:
+                    logger.warning("Send queue full, disconnecting %d", self._id)
+                    self._dead = True
+                    self.cancel()
+                self.lost += e.count
+                return True
+            else:
+                return False
+        self._put(e)
+        return True
+
+    def offer(self, action:str, msg:bytes, key=None) -> bool:
         """
-        await self._send_q.send(data)
+        Queue an already-packed message without blocking the caller.
+
+        If the queue is full and the overflow policy is to block, the
+        entry waits for room. A keyed one is replaced by later ones with
+        the same key. If ``queue_len`` unkeyed entries are already
+        waiting, the entry is dropped.
+
+        Returns False if the message was dropped.
+        """
+        e = _Entry(key, action, msg)
+        if self._try_enqueue(e):
+            return True
+        if key is not None:
+            self._pending[key] = e
+            return True
+        if len(self._later) >= self.queue_len:
+            self.dropped += e.count
+            if self._dead:
+                self.lost += e.count
+            return False
+        self._later.append(e)
+        return True
+
+    def _full(self, size=0):
+        return len(self._q) >= self.queue_len or \
+                (self.queue_bytes and self._q and self._q_bytes+size > self.queue_bytes)
+
+    def _drop(self, size):
+        """
+        Drop the oldest queued messages to make room for ``size`` bytes.
+        Requests are not dropped.
+        """
+        q = self._q
+        keep = []
+        while q and self._full(size):
+            e = q.popleft()
+            if e.action == "req":
+                keep.append(e)
+                continue
+            self._q_bytes -= len(e.msg)
+            if e.key is not None:
+                del self._keyed[e.key]
+            self.dropped += e.count
+        q.extendleft(reversed(keep))
+
+    def _put(self, e):
+        self._q.append(e)
+        self._q_bytes += len(e.msg)
+        if e.key is not None:
+            self._keyed[e.key] = e
+        self._not_empty.set()
+
+    def discard(self):
+        """
+        Forget the queued messages, except for requests. Used when the
+        client's state is rebuilt from scratch anyway.
+        """
+        keep = [e for e in self._q if e.action == "req"]
+        self._q.clear()
+        self._q_bytes = 0
+        self._keyed.clear()
+        self._delayed.clear()
+        self._pending.clear()
+        self._later.clear()
+        for e in keep:
+            self._put(e)
+        if self._not_full is not None:
+            self._not_full.set()
+            self._not_full = None
+
+    def _put_first(self, entries):
+        """
+        Queue these entries, in order, ahead of everything else.
+        """
+        for e in reversed(entries):
+            self._q.appendleft(e)
+            self._q_bytes += len(e.msg)
+            if e.key is not None:
+                self._keyed[e.key] = e
+        if entries:
+            self._not_empty.set()
+
+    async def _send_later(self, key, when):
+        await trio.sleep_until(when)
+        e = self._delayed.pop(key, None)
+        if e is not None: # else `adopt` took it
+            self._put(e)
+
+    def stats(self) -> dict:
+        """
+        Returns some statistics about this connection.
+
+        ``ratio`` is the number of frames per message sent. Lower is better.
+        ``stall_time`` is the time spent waiting for the client to
+        acknowledge data. ``lost`` counts messages that were dropped while
+        the client was disconnected, since it last resumed.
+        """
+        return dict(
+            frames_out=self.frames_out,
+            msgs_out=self.msgs_out,
+            ratio=self.frames_out/self.msgs_out if self.msgs_out else None,
+            coalesced=self.coalesced,
+            dropped=self.dropped,
+            lost=self.lost,
+            queue_len=len(self._q),
+            queue_bytes=self._q_bytes,
+            bytes_out=self.bytes_out,
+            unacked=self.bytes_out-self.bytes_acked,
+            stall_time=self.stall_time,
+            compressed=self.compressor.frames if self.compressor else 0,
+            compressed_saved=self.compressor.bytes_in-self.compressor.bytes_out if self.compressor else 0,
+        )
 
 
 class BaseWorker:
@@ -178,13 +766,30 @@ class BaseWorker:
     _nursery = None
 
     title = "You forgot to set a title"
+    concurrency = 1
+    # Max number of messages from the client that are processed in
+    # parallel. See `order_key`.
+
+    overflow = "block"
+    # What to do when the client can't keep up and the send queue is full:
+    # "block" the sender, "drop_oldest" queued messages, "coalesce"
+    # (don't block for keyed messages, see `Worker.coalesce`), or
+    # "disconnect" the client.
     fatal_msg = "The server had a fatal error.<br />It was logged and will be fixed soon."
     version = None # The server uses DeFramed's version if not set here
 
     def __init__(self, app):
         self._p_lock = trio.Lock()
         self._app = app
-        self.uuid = uuid1()
+        self.uuid = uuid1(app.process) # the runner routes by node ID
+        self.trace = WireTrace.sampled(app.cfg.trace)
+
+        # Frames the client has not yet acknowledged, for resuming
+        self._seq = 0
+        self._replay = deque() # (seq, entry)
+        self._replay_bytes = 0
+        self.replayed = 0
+        self._groups = set()
         app.clients[self.uuid] = self
 
     @property
@@ -203,12 +808,79 @@ class BaseWorker:
         """
         Use this socket to talk. Called by the app.
 
-        The worker's previous websocket is cancelled.
+        The worker's previous websocket is cancelled. Messages it didn't
+        get to send are sent on this one.
         """
-        if self._talker is not None:
-            self._talker.cancel()
+        old = self._talker
+        if old is not None:
+            old.cancel()
         self._talker = talker
         talker.attach(self)
+        if old is not None and old is not talker:
+            talker.adopt(old)
+        self._app.clients.attach(self)
+
+    def _sent(self, e):
+        """
+        Called by the talker when it sends a frame. Remember it until the
+        client acknowledges it.
+        """
+        self._seq += 1
+        cfg = self._app.cfg.ws
+        if not cfg.replay_len:
+            return
+        r = self._replay
+        r.append((self._seq, e))
+        self._replay_bytes += len(e.msg)
+        while len(r) > cfg.replay_len or \
+                (len(r) > 1 and self._replay_bytes > cfg.replay_bytes):
+            self._replay_bytes -= len(r.popleft()[1].msg)
+
+    def _acked(self, seq):
+        """
+        The client has processed all frames up to ``seq``.
+        """
+        r = self._replay
+        while r and r[0][0] <= seq:
+            self._replay_bytes -= len(r.popleft()[1].msg)
+
+    def resume(self, seq) -> bool:
+        """
+        The client has reconnected and says that the last frame it
+        processed was number ``seq``. Re-send the frames it missed.
+
+        Called by `Worker.msg_setup` right after `attach`.
+
+        Returns False if the frames are no longer available, or if
+        messages were dropped while the client was away; the client's
+        state is then unknown and needs to be rebuilt from scratch.
+        """
+        r = self._replay
+        t = self._talker
+        if seq is None or seq > self._seq or t.lost:
+            ok = False
+        elif seq == self._seq:
+            ok = True
+        else:
+            ok = bool(r) and r[0][0] <= seq+1
+        t.lost = 0
+        if not ok:
+            # What was queued while the client was away is superseded
+            # by rebuilding it.
+            t.discard()
+        self._acked(seq or 0)
+        frames = [e for _,e in r] if ok else []
+        r.clear()
+        self._replay_bytes = 0
+
+        # The talker numbers the frames again as it sends them,
+        # thus we continue counting where the client is.
+        self._seq = seq or 0
+        # These go out before whatever was sent while the client was away.
+        # Each is a whole frame, which the client treats as one message.
+        t._put_first([_Entry(None, e.action, e.msg) for e in frames])
+        self.replayed += len(frames)
+        return ok
 
     async def _monitor(self, *, task_status=trio.TASK_STATUS_IGNORED):
         """
@@ -225,7 +897,8 @@ class BaseWorker:
         You don't want to override this. Your main code should be in
         `talk`, your setup code (called by the server) in `init`.
         """
-        t = Talker(websocket)
+        t = Talker(websocket, self._app.cfg.ws,
+                self._app.compressor(getattr(websocket, "headers", {})))
 
         try:
             async with trio.open_nursery() as n:
@@ -240,7 +913,10 @@ class BaseWorker:
                     finally:
                         self._scope = None
         except Exception:
+            if self.trace:
+                logger.warning("Trace of %s:\n%s", self.uuid, self.trace.dump())
             await t.died(self.fatal_msg)
+            self._app.clients.evict(self, "error")
             raise
         # not on BaseException, as in that case we close the connection and
         # expect the client to try reconnecting
@@ -281,20 +957,134 @@ class BaseWorker:
         """internal method, called by the Talker"""
         if self._talker is talker:
             logger.debug("DISCONNECT")
+            self._app.clients.detach(self)
             await self.disconnect()
 
     async def disconnect(self):
         """
         The client websocket disconnected. This method might not be called
         when a client reattaches.
+
+        The session is kept for ``session.grace`` seconds, so that the
+        client can reconnect.
         """
         self.cancel()
 
+    async def evicted(self, reason: str):
+        """
+        The session has been removed from the app's registry and will not
+        be reattached. Override this to release resources.
+
+        Args:
+          reason: why: ``"grace"`` (disconnected for too long), ``"idle"``,
+            ``"count"`` or ``"memory"`` (too many sessions), or ``"error"``.
+        """
+        pass
+
+    def join(self, group):
+        """
+        Join a group, for `App.broadcast`.
+        """
+        self._app.join(group, self)
+
+    def leave(self, group=None):
+        """
+        Leave a group, or all of them.
+        """
+        for g in (self._groups.copy() if group is None else (group,)):
+            self._app.leave(g, self)
+
+    def memory(self) -> int:
+        """
+        Estimate the memory this session uses, in bytes, for the
+        ``session.max_bytes`` limit. The default counts queued and
+        unacknowledged frames. Override this to add your own data.
+        """
+        res = self._replay_bytes
+        if self._talker is not None:
+            res += self._talker._q_bytes
+        return res
+
     async def send(self, data:Any):
         """
         Send a message to the client.
+
+        Within :meth:`batch`, the message is queued instead.
+        """
+        await self._queue(data)
+
+    async def _queue(self, data:Any, key=None, interval:float=None, many:bool=False):
+        buf = batching.get()
+        if buf is not None:
+            if many:
+                buf.extend(data)
+            else:
+                buf.append(data)
+            return
+        if many:
+            await self._talker.send_many(data, key=key, interval=interval)
+        else:
+            await self._talker.send(data, key=key, interval=interval)
+
+    @asynccontextmanager
+    async def batch(self):
+        """
+        Collect all messages sent by the current task, then send them to
+        the client as a single frame::
+
+            async with worker.batch():
+                await worker.set_content("one", "1")
+                await worker.set_content("two", "2")
+
+        Nothing is sent if the block raises an exception.
+        Nested batches are sent when the outermost block ends.
         """
-        await self._talker.send(data)
+        if batching.get() is not None:
+            yield
+            return
+        buf = []
+        tk = batching.set(buf)
+        try:
+            yield
+        finally:
+            batching.reset(tk)
+        if buf:
+            await self._talker.send_many(buf)
+
+    async def _flush_batch(self):
+        """
+        Send the messages batched so far by the current task, if any.
+        """
+        buf = batching.get()
+        if buf:
+            msgs = buf[:]
+            buf.clear()
+            await self._talker.send_many(msgs)
+
+    def start_trace(self, size: int = None):
+        """
+        Start tracing this session's websocket frames, if that's not
+        already happening. See `deframed.trace.WireTrace`.
+
+        Args:
+          size: the ring buffer's size. The default is ``trace.size``
+            from the configuration.
+        """
+        if self.trace is None:
+            self.trace = WireTrace(size or self._app.cfg.trace.size)
+            if self._talker is not None:
+                self._talker.trace = self.trace
+
+    def stats(self) -> dict:
+        """
+        Returns some statistics about this session.
+        """
+        if self._talker is None:
+            return {}
+        res = self._talker.stats()
+        res.update(seq=self._seq, replay_len=len(self._replay),
+                replay_bytes=self._replay_bytes, replayed=self.replayed)
+        return res
 
     async def data_in(self, data):
         """
@@ -302,6 +1092,24 @@ class BaseWorker:
         """
         pass
 
+    def order_key(self, action, data):
+        """
+        If `concurrency` is more than one, messages for which this method
+        returns the same key are processed in order.
+
+        The default is to order by action.
+        """
+        return action
+
+    def reply_in(self, n, data):
+        """
+        Process a reply from the client.
+
+        This is called directly by the talker's read loop, so that
+        replies are not delayed by slow handlers. It must not block.
+        """
+        pass
+
 
 class Worker(BaseWorker):
     """
@@ -310,47 +1118,164 @@ class Worker(BaseWorker):
     The talker's read loop calls ``.msg_{action}`` methods with the
     incoming message. Code in those methods must not call ``.request``
     because that would cause a deadlock. (Don't worry, DeFramed catches
-    those.) Start a separate task with ``.spawn`` if you need to do this.
+    those.) Start a separate task with ``.spawn`` if you need to do this,
+    or set ``concurrency`` to more than one.
     """
     _persistent_nursery = None
     _kill_exc = None
     _kill_flag = None
 
+    coalesce = False
+    # If set, an update to some element (by `set_content`, `set_element`
+    # or `set_attr`) replaces an earlier one that has not been sent yet.
+    # Other messages queued in between still arrive before it.
+    # Don't set this if you replace both some element and its parent.
+
+    diff = False
+    # If set, `set_content` and `set_element` remember the HTML they sent
+    # and send changes as patches. Don't modify these elements' content
+    # any other way. Not used for coalesced or rate-limited elements.
+
+    request_timeout = 60
+    # Default timeout for requests to the client, in seconds.
+
+    max_requests = 100
+    # Max number of pending requests. More requests wait.
+
+    _handlers = None # kind > name > method name
+
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        cls._build_handlers()
+
+    @classmethod
+    def _build_handlers(cls):
+        """
+        Collect the ``msg_*``, ``button_*`` and ``form_*`` methods, plus
+        those declared with `on_msg`, `on_button` and `on_form`.
+
+        A declaration is inherited, and applies to the method with that
+        name: a subclass may override the method without repeating it.
+        """
+        h = {"msg":{}, "button":{}, "form":{}}
+        for name in dir(cls):
+            proc = getattr(cls, name, None)
+            if not callable(proc):
+                continue
+            kind,_,hname = name.partition("_")
+            if hname and kind in h:
+                h[kind][hname] = name
+        # explicit declarations win, the subclass's first
+        for c in reversed(cls.__mro__):
+            for name,proc in vars(c).items():
+                decl = getattr(proc, "_df_handler", None)
+                if decl is None:
+                    # staticmethod or classmethod
+                    decl = getattr(getattr(proc, "__func__", None), "_df_handler", ())
+                for kind,hname in decl:
+                    h[kind][hname] = name
+        cls._handlers = h
+
+    @classmethod
+    def handlers(cls) -> Dict[str,List[str]]:
+        """
+        Returns the names of the messages, buttons and forms this worker
+        class handles, as a dict with the keys ``msg``, ``button`` and
+        ``form``.
+        """
+        return {k: sorted(v.keys()) for k,v in cls._handlers.items()}
+
+    def order_key(self, action, data):
+        """
+        If `concurrency` is more than one, messages for which this method
+        returns the same key are processed in order.
+
+        The default is to order buttons and forms by their ID, everything
+        else by action.
+        """
+        if action == "button":
+            return (action, data)
+        if action == "form":
+            return (action, data[0])
+        return action
+
     def __init__(self,*a,**k):
         super().__init__(*a,**k)
         self._n = 1
         self._req = {}
+        self._req_limit = trio.Semaphore(self.max_requests)
+        self._req_stats = dict(requests=0, timeouts=0, failed=0, req_time=0.0, req_max=0.0)
+        self._interval = {}
+        self._tpl_known = set() # hashes of templates the client has
+        self._diff_state = {} # (mode,id) > parsed HTML, see `diff`
         self.main_showing = trio.Event()
 
     async def data_in(self, data):
         """
         Process incoming data. Must be structured [type,data].
 
-        Replies are special:["reply",[assoc_nr,data]].
+        Replies are special:["reply",[assoc_nr,data]]. They're usually
+        processed by the talker, via `reply_in`.
         """
         action,data = data
         if action == "reply":
-            await self._reply(*data)
+            self.reply_in(*data)
             return
-        try:
-            res = getattr(self, 'msg_'+action)
-        except AttributeError:
-            res = partial(self.any_msg,action)
         tk = processing.set((action,data))
         try:
-            await res(data)
+            p = self._handlers["msg"].get(action)
+            if p is None:
+                await self.any_msg(action, data)
+            else:
+                await getattr(self, p)(data)
         finally:
             processing.reset(tk)
 
-    async def _reply(self, n, data):
+    def reply_in(self, n, data):
         if isinstance(data,Mapping) and '_error' in data:
             data = ClientError(**data)
-        try:
-            evt,self._req[n] = self._req[n],data
-        except KeyError:
+        evt = self._req.get(n)
+        if not isinstance(evt, trio.Event):
             return  # stale or whatever
+        self._req[n] = data
         evt.set()
 
+    def _fail_requests(self, exc):
+        """
+        Terminate all pending requests with this error.
+        """
+        for n,evt in list(self._req.items()):
+            if isinstance(evt, trio.Event):
+                self._req[n] = exc
+                evt.set()
+
+    def attach(self, talker):
+        if self._talker is not None and self._talker is not talker:
+            self._fail_requests(DisconnectedError())
+        super().attach(talker)
+
+    async def maybe_disconnect(self, talker):
+        if self._talker is talker:
+            self._fail_requests(DisconnectedError())
+        await super().maybe_disconnect(talker)
+
+    async def evicted(self, reason: str):
+        self.cancel(True)
+        await super().evicted(reason)
+
+    def stats(self) -> dict:
+        """
+        Returns some statistics about this session.
+
+        This adds the number of ``requests`` sent to the client, how many of
+        them timed out or ``failed``, and their total and maximum round
+        trip time.
+        """
+        res = super().stats()
+        res.update(self._req_stats)
+        res["pending"] = len(self._req)
+        return res
+
     def cancel(self, persistent=False):
         if persistent and self._persistent_nursery is not None:
             self._persistent_nursery.cancel_scope.cancel()
@@ -378,26 +1303,66 @@ class Worker(BaseWorker):
         await self.main_showing.wait()
         await super()._talk()
 
-    async def get_attr(self, **a: Dict[str,List[str]]) -> Dict[str,Optional[List[str]]]:
+    async def query(self, ids: List[str] = (), selectors: List[str] = (),
+            facts: List[str] = (), attrs: Optional[List[str]] = None) -> Dict[str,Optional[dict]]:
         """
-        Returns a list of attributes for some element.
-        The element is identified by its ID.
+        Collect information about some elements, in a single round trip.
 
-        Returns: a dict with corresponding values, or None if the element
-        does not exist.
+        Args:
+          ids:
+            the IDs of the elements to look up.
+          selectors:
+            CSS selectors. The first matching element is used.
+          facts:
+            what to return about each element:
+            ``attrs`` (a dict of attributes),
+            ``box`` (the bounding client rectangle),
+            ``scroll`` (the scroll area's height/width/top/left),
+            ``value``, and ``checked``.
+          attrs:
+            the attributes to return. The default is all of them.
+
+        Returns:
+          a dict that maps each ID and selector to a dict with the
+          requested facts, or to `None` if the element doesn't exist.
+        """
+        req = dict(ids=list(ids), sel=list(selectors), facts=list(facts))
+        if attrs is not None:
+            req["attrs"] = list(attrs)
+        res = await self.request("query", req)
+        r = dict(zip(req["ids"], res["ids"]))
+        r.update(zip(req["sel"], res["sel"]))
+        return r
+
+    async def get_attr(self, *ids: str, attrs: Optional[List[str]] = None) -> Dict[str,Optional[Dict[str,str]]]:
+        """
+        Returns the attributes of some elements.
+        The elements are identified by their ID.
+
+        Args:
+          attrs:
+            the attributes to return. The default is all of them.
+
+        Returns: a dict that maps each ID to a dict of attributes, or to
+        `None` if the element does not exist.
         """
+        res = await self.query(ids, facts=("attrs",), attrs=attrs)
+        return {k: (v["attrs"] if v is not None else None) for k,v in res.items()}
 
     async def exists(self, id) -> bool:
         """
         Check whether the DOM element with this ID exists.
         """
-        return (await self.get_attr({id:{}}))[id] is not None
+        return (await self.query((id,)))[id] is not None
 
     async def elem_info(self, id) -> dict:
         """
         Return information about this element (size, position)
         """
-        return await self.request("elem_info", id)
+        r = (await self.query((id,), facts=("box","scroll")))[id]
+        if r is None:
+            return None
+        return dict(height=r["scroll"]["height"], width=r["scroll"]["width"], view=r["box"])
 
     async def msg_setup(self, data) -> bool:
         """
@@ -407,20 +1372,37 @@ class Worker(BaseWorker):
 
         Returns True when the client either has a version mismatch (and is
         reloaded) or sends a known UUID (and is reassigned).
+
+        A reassigned client also tells us the number of the last frame it
+        has processed. The frames it missed are sent again if possible;
+        if not, the worker it's reassigned to calls ``show_main``.
         """
         v = data.get('version')
         if v is not None and v != self._app.version:
             await self.send('reload',True)
             return True
 
-        await self._setup();
-
+        token = data.get('token', None)
         uuid = data.get('uuid')
-        if uuid is None or not self.set_uuid(uuid):
-            await self.show_main(token=data.get('token', None))
-        else:
+        if uuid is not None:
+            try:
+                uuid = UUID(uuid)
+            except ValueError:
+                uuid = None
+        tpl = set(data.get('templates') or ())
+        if uuid is not None and self.set_uuid(uuid):
+            w = self._app.clients[uuid]
+            w._tpl_known = tpl
+            if not w.resume(data.get('seq')):
+                await w._setup()
+                await w.show_main(token=token)
             return True
 
+        self._tpl_known = tpl
+        self.resume(data.get('seq', 0))
+        await self._setup()
+        await self.show_main(token=token)
+
     async def msg_form(self, data):
         """
         Process form submissions.
@@ -428,12 +1410,11 @@ class Worker(BaseWorker):
         The default calls ``.form_{name}(**data)`` or ``.any_form(name,data)``.
         """
         name, data = data
-        try:
-            p = getattr(self,"form_"+name)
-        except AttributeError:
+        p = self._handlers["form"].get(name)
+        if p is None:
             await self.any_form(name, data)
         else:
-            await p(**data)
+            await getattr(self, p)(**data)
 
     async def msg_button(self, name):
         """
@@ -441,12 +1422,11 @@ class Worker(BaseWorker):
 
         The default calls ``.button_{name}()`` or ``.any_button(name)``.
         """
-        try:
-            p = getattr(self,"button_"+name)
-        except AttributeError:
+        p = self._handlers["button"].get(name)
+        if p is None:
             await self.any_button(name)
         else:
-            await p()
+            await getattr(self, p)()
 
     async def any_button(self, name):
         """
@@ -471,6 +1451,7 @@ class Worker(BaseWorker):
         Called by `msg_setup`.
         You probably should not override this.
         """
+        self._diff_state.clear()
         await self.send("setup", version=self._app.version, uuid=str(self.uuid))
 
     async def alert(self, level, text, **kw):
@@ -537,7 +1518,13 @@ class Worker(BaseWorker):
             instead of (``None``) the existing content. The default is
             ``None``.
         """
-        await self.send("set", [id, html, prepend]);
+        self._diff_state.pop(("elem",id), None)
+        if prepend is None:
+            if not await self._patch("set", id, html):
+                await self._update(("set",id), ["set", [id, html, prepend]])
+        else:
+            self._diff_state.pop(("set",id), None)
+            await self.send("set", [id, html, prepend]);
 
     async def set_element(self, id: str, html: str):
         """
@@ -549,7 +1536,173 @@ class Worker(BaseWorker):
           html:
             the element's replacement.
         """
-        await self.send("elem", [id, html]);
+        self._diff_state.pop(("set",id), None)
+        if not await self._patch("elem", id, html):
+            await self._update(("elem",id), ["elem", [id, html]])
+
+    async def set_elements(self, elems: Dict[str,str], patches: Dict[str,tuple] = None):
+        """
+        Replace or modify several elements.
+
+        The changes are sent in a single message, which the client
+        applies in one go; the focus and caret position are restored once,
+        at the end.
+
+        Args:
+          elems:
+            a dict of old element IDs to their replacements.
+          patches:
+            a dict of element IDs to ``(attrs, style, content)``. ``attrs``
+            and ``style`` are dicts of attributes and style properties to
+            set, or to remove if the value is `None`. ``content`` is the
+            element's new inner HTML, or `None` to leave it alone.
+            Patches are not rate limited.
+        """
+        msgs = []
+        changes = []
+        for id, (attrs, style, content) in (patches or {}).items():
+            self._diff_state.pop(("elem",id), None)
+            self._diff_state.pop(("set",id), None)
+            changes.append([id, attrs, style, content])
+        for id, html in elems.items():
+            if id in self._interval:
+                # rate limited: this one goes out on its own
+                await self.set_element(id, html)
+                continue
+            self._diff_state.pop(("set",id), None)
+            msg = self._diffed("elem", id, html)
+            if msg is None:
+                changes.append([id, html])
+            elif msg is not True:
+                msgs.append(msg)
+        if changes:
+            msgs.append(["elems", changes])
+        if len(msgs) == 1:
+            await self._queue(msgs[0])
+        elif msgs:
+            await self._queue(msgs, many=True)
+
+    async def _patch(self, mode, id, html) -> bool:
+        """
+        If diffing is on, remember this HTML, and send the changes if that's
+        shorter. Returns False if the caller needs to send the whole thing.
+        """
+        msg = self._diffed(mode, id, html)
+        if msg is None:
+            return False
+        if msg is not True:
+            await self.send(msg)
+        return True
+
+    def _diffed(self, mode, id, html):
+        """
+        Returns a patch message for this HTML, `True` if nothing changed,
+        or `None` if the whole thing needs to be sent.
+        """
+        if not self.diff or self.coalesce or id in self._interval \
+                or self.overflow == "drop_oldest":
+            return None
+        key = (mode,id)
+        new = _diff.parse(html)
+        old = self._diff_state.get(key)
+        self._diff_state[key] = new
+        if old is None:
+            return None
+        ops = _diff.diff(old, new, mode == "elem")
+        if ops is None:
+            return None
+        if not ops:
+            return True
+        msg = PackedMessage("patch", [mode, id, ops])
+        if len(msg.msg) >= len(html):
+            return None
+        return msg
+
+    async def msg_patch_fail(self, data):
+        """
+        The client couldn't apply a patch. Send the whole content.
+        """
+        mode, id = data
+        nodes = self._diff_state.get((mode,id))
+        if nodes is None:
+            return
+        if mode == "set":
+            await self.send("set", [id, _diff.serialize(nodes), None])
+        else:
+            await self.send("elem", [id, _diff.serialize(nodes)])
+
+    async def _update(self, key, msg, many=False):
+        """
+        Send a message (or, with ``many``, a list of them) which supersedes
+        an earlier one with the same key, if coalescing is enabled or the
+        element is rate limited.
+        """
+        interval = self._interval.get(key[1])
+        if interval is None and not self.coalesce:
+            key = None
+        await self._queue(msg, key=key, interval=interval, many=many)
+
+    async def render(self, id: str, template: str, data: dict = None, **kw):
+        """
+        Render a Mustache template on the client and use the result as an
+        element's content.
+
+        The template is sent only once; the client stores it (in
+        localStorage, keyed by its hash) and tells us which templates it
+        has when it connects. After that, only the hash and the data are
+        sent.
+
+        Args:
+          id:
+            the HTML element's ID.
+          template:
+            the template's name, see `App.template`.
+          data:
+            the data to render. Keyword arguments are added to it.
+        """
+        if kw:
+            data = dict(data or {}, **kw)
+        # We don't know the HTML the client renders, thus can't diff later
+        # updates against it.
+        self._diff_state.pop(("elem",id), None)
+        self._diff_state.pop(("set",id), None)
+        h, text = self._app.template(template)
+        msg = ["render", [id, h, data]]
+        if h in self._tpl_known:
+            await self._update(("set",id), msg)
+        else:
+            self._tpl_known.add(h)
+            await self._update(("set",id), [["tpl", [h, text]], msg], many=True)
+
+    async def msg_template(self, h):
+        """
+        The client wants a template it doesn't have (any more).
+        """
+        text = self._app.template_by_hash(h)
+        if text is None:
+            logger.warning("Client wants unknown template %r", h)
+            return
+        self._tpl_known.add(h)
+        await self.send("tpl", [h, text])
+
+    def set_rate(self, id: str, rate: Optional[float]):
+        """
+        Limit the rate of updates to an element.
+
+        Updates that arrive too quickly are delayed; a newer update
+        replaces a delayed one. This implies `coalesce` for this element.
+
+        Args:
+          id:
+            the HTML element's ID.
+          rate:
+            the maximum number of updates per second, or `None` to
+            remove the limit.
+        """
+        if rate is None:
+            self._interval.pop(id, None)
+        else:
+            self._interval[id] = 1/rate
 
     async def load_style(self, id, url):
         """
@@ -568,7 +1721,11 @@ class Worker(BaseWorker):
           attr=value:
             the element's changed attributes.
         """
-        await self.send("set_attr", [id, attrs]);
+        if self.coalesce or id in self._interval:
+            for k,v in attrs.items():
+                await self._update(("set_attr",id,k), ["set_attr", [id, {k:v}]])
+        else:
+            await self.send("set_attr", [id, attrs]);
 
     async def add_class(self, id: str, *cls):
         """
@@ -693,8 +1850,16 @@ class Worker(BaseWorker):
 
         This method does not wait for a reply.
 
+        ``action`` may also be a `PackedMessage`; ``data`` must then be
+        empty.
+
         You should probably call one of the specific ``send_*` methods instead.
         """
+        if isinstance(action, PackedMessage):
+            if data is not None or kw:
+                raise TypeError("A PackedMessage already has its data")
+            await super().send(action)
+            return
         if action == "req":
             raise RuntimeError("Use '.request' for that!")
         if kw:
@@ -755,7 +1920,7 @@ class Worker(BaseWorker):
             return await self.request("assign", var=obj, val=value)
 
 
-    async def request(self, action:str, data:Any=None, var:str=None, **kw):
+    async def request(self, action:str, data:Any=None, var:str=None, timeout:float=None, **kw):
         """
         Send a request to the client, await+return the reply.
 
@@ -763,27 +1928,58 @@ class Worker(BaseWorker):
 
         If the reply is a promise, the reply is delayed until the promuise is resolved.
 
-        Errors are re-raised as `ClientError`.
+        Errors are re-raised as `ClientError`. If there's no reply within
+        @timeout seconds (default: `request_timeout`), `trio.TooSlowError`
+        is raised. If the client disconnects, `DisconnectedError` is raised.
         """
-        if processing.get():
+        if processing.get() and self.concurrency <= 1:
             raise RuntimeError("You cannot call this from within the receiver. Use a task.",processing.get())
-
-        self._n += 1
-        n = self._n
-        self._req[n] = evt = trio.Event()
+        if timeout is None:
+            timeout = self.request_timeout
 
         if kw:
             if data:
                 data.update(kw)
             else:
                 data = kw
+        st = self._req_stats
+        st["requests"] += 1
+        t = trio.current_time()
+        try:
+            with trio.fail_after(timeout or math.inf):
+                async with self._req_limit:
+                    res = await self._request(action, data, var)
+        except trio.TooSlowError:
+            st["timeouts"] += 1
+            raise
+        except Exception:
+            st["failed"] += 1
+            raise
+        t = trio.current_time()-t
+        st["req_time"] += t
+        if st["req_max"] < t:
+            st["req_max"] = t
+        return res
+
+    async def _request(self, action, data, var):
+        self._n += 1
+        n = self._n
+        self._req[n] = evt = trio.Event()
+
         args = [action,n,data]
         if var is not None:
             if isinstance(var, Proxy):
                 var = var.name
             args.append(var)
         try:
-            await super().send(["req",args])
+            # The request must not be held up by a batch, or we'd deadlock.
+            # What's been batched before it needs to arrive first, though.
+            await self._flush_batch()
+            tk = batching.set(None)
+            try:
+                await super().send(["req",args])
+            finally:
+                batching.reset(tk)
             await evt.wait()
         except BaseException:
             self._req.pop(n)
@@ -868,8 +2064,8 @@ class Worker(BaseWorker):
         del self._app.clients[self.uuid]
         w = self._app.clients.get(uuid)
         if w is None:
-            self._app.clients[self.uuid] = self
             self.uuid = uuid
+            self._app.clients[self.uuid] = self
             return False
         else:
             w.attach(self._talker)
@@ -877,6 +2073,9 @@ class Worker(BaseWorker):
             return True
 
 
+Worker._build_handlers()
+
+
 class SubWorker(BaseWorker):
     """
     This is a worker that attaches to another via an iframe.
@@ -0,0 +1,119 @@
+"""
+Test helpers: a fake websocket, and sessions that talk to it.
+"""
+
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import App
+from deframed.util import packer, unpacker
+
+
+class Disconnected(BaseException):
+    """
+    The fake client went away.
+    """
+    pass
+
+
+class FakeSocket:
+    """
+    The server's end of a websocket. Frames sent to the client are
+    unpacked and collected in ``frames``.
+
+    The client doesn't acknowledge anything by itself; call `ack`.
+    """
+    def __init__(self):
+        self.frames = []
+        self.headers = {}
+        self.closed = False
+        self.blocked = None # set to a trio.Event to stall sending
+        self._w, self._r = trio.open_memory_channel(100)
+
+    async def send(self, msg):
+        if self.blocked is not None:
+            await self.blocked.wait()
+        if self.closed:
+            raise Disconnected()
+        self.frames.append(unpacker(msg))
+
+    async def receive(self):
+        msg = await self._r.receive()
+        if msg is None:
+            self.closed = True
+            raise Disconnected()
+        return msg
+
+    async def put(self, action, data=None):
+        """
+        The client sends a message.
+        """
+        await self._w.send(packer([action, data]))
+        await wait_all_tasks_blocked()
+
+    async def ack(self, worker):
+        """
+        The client acknowledges everything it got so far.
+        """
+        await self.put("ack", [worker._talker.bytes_out, len(self.frames)])
+
+    async def close(self):
+        await self._w.send(None)
+        await wait_all_tasks_blocked()
+
+    def messages(self, action=None):
+        """
+        The messages the client got, with batches taken apart.
+        """
+        res = []
+        for f in self.frames:
+            res.extend(f[1] if f[0] == "batch" else [f])
+        if action is not None:
+            res = [m[1] for m in res if m[0] == action]
+        return res
+
+
+async def _run(worker, ws):
+    try:
+        await worker.run(ws)
+    except BaseException as exc:
+        if isinstance(exc, trio.Cancelled):
+            raise
+        # the client went away
+
+
+@pytest.fixture
+def app(nursery):
+    """
+    Returns a function that creates an `App` for this worker class. Keyword
+    arguments are added to the configuration.
+    """
+    def make(worker, **cfg):
+        a = App(cfg, worker)
+        a.main = nursery
+        return a
+    return make
+
+
+@pytest.fixture
+def connect(nursery):
+    """
+    Returns a function that starts a new session of this app, or resumes
+    one if a UUID is given, and returns ``(worker, socket)``. The worker
+    is the one that ends up owning the socket.
+    """
+    async def connect(app, uuid=None, seq=0, setup=True):
+        ws = FakeSocket()
+        w = app.worker(app)
+        nursery.start_soon(_run, w, ws)
+        await wait_all_tasks_blocked()
+        if setup:
+            data = dict(seq=seq)
+            if uuid is not None:
+                data["uuid"] = str(uuid)
+            await ws.put("setup", data)
+            if uuid is not None:
+                w = app.clients.get(uuid, w)
+        return w, ws
+    return connect
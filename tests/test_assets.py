@@ -0,0 +1,55 @@
+import os
+import time
+from email.utils import formatdate
+
+import pytest
+
+from deframed.assets import StaticFiles
+from deframed.default import CFG
+
+
+@pytest.fixture
+def files(tmp_path):
+    d = tmp_path / "static"
+    d.mkdir()
+    (d / "main.js").write_text("var x = 1;\n" * 100)
+    os.utime(d / "main.js", (1600000000, 1600000000))
+    s = StaticFiles([str(d)], CFG.assets)
+    s.scan()
+    return s
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    # far from UTC, so that mixing up local and UTC time shows
+    monkeypatch.setenv("TZ", "XXX+10")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_lookup(files):
+    status, body, hdr = files.lookup("main.js", {"Accept-Encoding": "gzip"})
+    assert status == 200
+    assert hdr["Content-Encoding"] == "gzip"
+    assert hdr["Last-Modified"] == formatdate(1600000000, usegmt=True)
+    assert files.lookup("nope.js", {}) is None
+    assert files.stats()[None] == 1
+
+
+def test_etag(files):
+    etag = files.lookup("main.js", {})[2]["ETag"]
+    assert files.lookup("main.js", {"If-None-Match": etag})[0] == 304
+    assert files.lookup("main.js", {"If-None-Match": '"other"'})[0] == 200
+
+
+@pytest.mark.parametrize("zone", ["GMT", "+0000", "-0000"])
+def test_modified_since(files, local_tz, zone):
+    def status(t):
+        ims = formatdate(t, usegmt=True).replace("GMT", zone)
+        return files.lookup("main.js", {"If-Modified-Since": ims})[0]
+
+    assert status(1600000000) == 304
+    assert status(1600000000+3600) == 304
+    assert status(1600000000-1) == 200
@@ -0,0 +1,78 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+
+
+class W(Worker):
+    title = "test"
+
+
+@pytest.mark.trio
+async def test_batch(app, connect):
+    w, ws = await connect(app(W))
+    n = len(ws.frames)
+    async with w.batch():
+        await w.send("info", text="one")
+        async with w.batch():
+            await w.send("info", text="two")
+        await wait_all_tasks_blocked()
+        assert len(ws.frames) == n
+    await wait_all_tasks_blocked()
+    assert len(ws.frames) == n+1
+    assert ws.frames[-1][0] == "batch"
+    assert ws.messages("info") == [dict(text="one"), dict(text="two")]
+
+
+@pytest.mark.trio
+async def test_batch_error(app, connect):
+    w, ws = await connect(app(W))
+    with pytest.raises(ZeroDivisionError):
+        async with w.batch():
+            await w.send("info", text="one")
+            1/0
+    await wait_all_tasks_blocked()
+    assert ws.messages("info") == []
+
+
+@pytest.mark.trio
+async def test_batch_spawn(app, connect):
+    # A task started within a batch doesn't add to it.
+    w, ws = await connect(app(W))
+    go = trio.Event()
+
+    async def later():
+        await go.wait()
+        await w.send("info", text="later")
+
+    async with w.batch():
+        await w.send("info", text="batched")
+        await w.spawn(later)
+    go.set()
+    await wait_all_tasks_blocked()
+    assert ws.messages("info") == [dict(text="batched"), dict(text="later")]
+
+
+@pytest.mark.trio
+async def test_batch_request(app, connect, nursery):
+    # A request doesn't overtake what has been batched before it.
+    w, ws = await connect(app(W))
+    res = []
+
+    async def ask():
+        async with w.batch():
+            await w.send("info", text="first")
+            res.append(await w.request("eval", dict(obj="x")))
+            await w.send("info", text="last")
+
+    nursery.start_soon(ask)
+    await wait_all_tasks_blocked()
+    msgs = ws.messages()
+    assert msgs[-2][1] == dict(text="first")
+    action, (req, n, data) = msgs[-1]
+    assert (action, req, data) == ("req", "eval", dict(obj="x"))
+
+    await ws.put("reply", [n, 42])
+    assert res == [42]
+    assert ws.messages()[-1] == ["info", dict(text="last")]
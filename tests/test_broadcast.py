@@ -0,0 +1,110 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+import deframed.worker
+from deframed import Worker
+from deframed.util import packer
+
+
+class W(Worker):
+    title = "test"
+
+
+async def sessions(app, connect, n, **cfg):
+    a = app(W, **cfg)
+    res = []
+    for _ in range(n):
+        res.append(await connect(a))
+    return a, res
+
+
+@pytest.mark.trio
+async def test_all(app, connect):
+    a, s = await sessions(app, connect, 3)
+    assert a.broadcast("info", dict(text="hi")) == 3
+    await wait_all_tasks_blocked()
+    for w, ws in s:
+        assert ws.messages("info") == [dict(text="hi")]
+
+
+@pytest.mark.trio
+async def test_packed_once(app, connect, monkeypatch):
+    a, s = await sessions(app, connect, 3)
+    calls = []
+
+    def counted(data):
+        calls.append(data)
+        return packer(data)
+
+    monkeypatch.setattr(deframed.worker, "packer", counted)
+    a.broadcast("info", dict(text="hi"))
+    await wait_all_tasks_blocked()
+    assert calls == [["info", dict(text="hi")]]
+    for w, ws in s:
+        assert ws.messages("info") == [dict(text="hi")]
+
+
+@pytest.mark.trio
+async def test_groups(app, connect):
+    a, s = await sessions(app, connect, 3)
+    (w1, ws1), (w2, ws2), (w3, ws3) = s
+    w1.join("g")
+    w2.join("g")
+    w2.join("h")
+    assert a.broadcast("info", dict(text="g"), group="g") == 2
+    assert a.broadcast("info", dict(text="x"), group="nope") == 0
+    assert a.broadcast("info", dict(text="f"), filter=lambda w: w is w3) == 1
+    await wait_all_tasks_blocked()
+    assert ws1.messages("info") == [dict(text="g")]
+    assert ws2.messages("info") == [dict(text="g")]
+    assert ws3.messages("info") == [dict(text="f")]
+
+    w2.leave()
+    assert not w2._groups
+    assert a.groups == {"g": {w1}}
+    w1.leave("g")
+    assert a.groups == {}
+
+
+@pytest.mark.trio
+async def test_slow_client(app, connect):
+    # A client that doesn't take anything doesn't hold up the others.
+    a, s = await sessions(app, connect, 2, ws=dict(queue_len=2))
+    (w1, ws1), (w2, ws2) = s
+    ws1.blocked = trio.Event()
+    for i in range(10):
+        a.broadcast("info", dict(text=str(i)))
+        await wait_all_tasks_blocked()
+    assert len(ws2.messages("info")) == 10
+    assert w1._talker.dropped > 0
+
+    ws1.blocked.set()
+    await wait_all_tasks_blocked()
+    assert len(ws1.messages("info")) < 10
+
+
+@pytest.mark.trio
+async def test_keyed(app, connect):
+    # A slow client only gets the latest state.
+    a, s = await sessions(app, connect, 1)
+    (w, ws), = s
+    ws.blocked = trio.Event()
+    a.broadcast("info", dict(text="stall"))
+    await wait_all_tasks_blocked()
+    for i in range(5):
+        a.broadcast("set", ["tick", str(i), None], key="tick")
+    ws.blocked.set()
+    await wait_all_tasks_blocked()
+    assert ws.messages("set") == [["tick", "4", None]]
+
+
+@pytest.mark.trio
+async def test_evicted(app, connect):
+    a, s = await sessions(app, connect, 2)
+    (w1, ws1), (w2, ws2) = s
+    w1.join("g")
+    w2.join("g")
+    a.clients.evict(w1, "test")
+    assert a.groups == {"g": {w2}}
+    assert a.broadcast("info", dict(text="hi"), group="g") == 1
@@ -0,0 +1,78 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+
+
+class W(Worker):
+    title = "test"
+    coalesce = True
+
+
+async def stalled(app, connect):
+    """
+    Returns a session whose client doesn't take anything, for now.
+    """
+    w, ws = await connect(app(W))
+    ws.blocked = trio.Event()
+    await w.send("info", text="stall") # stuck in the websocket
+    await wait_all_tasks_blocked()
+    return w, ws
+
+
+@pytest.mark.trio
+async def test_latest_wins(app, connect):
+    w, ws = await stalled(app, connect)
+    for i in range(5):
+        await w.set_content("a", str(i))
+    await w.set_content("b", "x")
+    assert w._talker.stats()["coalesced"] == 4
+
+    ws.blocked.set()
+    await wait_all_tasks_blocked()
+    assert ws.messages("set") == [["a", "4", None], ["b", "x", None]]
+
+
+@pytest.mark.trio
+async def test_order(app, connect):
+    # The final value must not overtake what was sent after the first one.
+    w, ws = await stalled(app, connect)
+    await w.set_element("a", '<p id="a">1</p>')
+    await w.add_class("a", "x")
+    await w.set_element("a", '<p id="a">2</p>')
+    await w.set_content("b", "1")
+    await w.send("append", ["b", "more"])
+    await w.set_content("b", "2")
+
+    ws.blocked.set()
+    await wait_all_tasks_blocked()
+    msgs = ws.messages()
+    msgs = msgs[msgs.index(["info", dict(text="stall")])+1:]
+    assert msgs == [
+        ["add_class", ["a", ["x"]]],
+        ["elem", ["a", '<p id="a">2</p>']],
+        ["append", ["b", "more"]],
+        ["set", ["b", "2", None]],
+    ]
+
+
+@pytest.mark.trio
+async def test_blocked(app, connect):
+    # Keyed messages that wait for room in the queue are replaced, too.
+    w, ws = await stalled(app, connect)
+    t = w._talker
+    t.queue_len = 1
+    await w.send("info", text="full")
+
+    async def upd(i):
+        await w.set_content("a", str(i))
+
+    async with trio.open_nursery() as n:
+        for i in range(3):
+            n.start_soon(upd, i)
+            await wait_all_tasks_blocked()
+        assert len(t._pending) == 1
+        ws.blocked.set()
+    await wait_all_tasks_blocked()
+    assert ws.messages("set") == [["a", "2", None]]
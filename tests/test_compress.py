@@ -0,0 +1,75 @@
+import zlib
+
+import pytest
+
+from deframed.util import packer, unpacker
+from deframed.compress import FrameCompressor, train_dictionary, SAMPLES
+
+HTML = "".join('<tr id="r%d"><td>%d</td><td><button type="button" class="btn btn-primary">Edit</button></td></tr>' % (i,i)
+        for i in range(20))
+
+
+def inflate(frame, zdict=None):
+    """
+    What the client does with a frame (``msg_z``, using pako.inflateRaw).
+    """
+    action, data = unpacker(frame)
+    if action != "z":
+        return frame
+    if zdict is None:
+        d = zlib.decompressobj(-15)
+    else:
+        d = zlib.decompressobj(-15, zdict=zdict)
+    return d.decompress(data) + d.flush()
+
+
+@pytest.mark.parametrize("mode", ["deflate", "dict"])
+def test_roundtrip(mode):
+    zdict = train_dictionary(SAMPLES)
+    c = FrameCompressor(mode, zdict)
+    msg = packer(["set", ["tbl", HTML, None]])
+    z = c.compress(msg)
+    assert unpacker(z)[0] == "z"
+    assert len(z) < len(msg)
+    assert inflate(z, c.zdict) == msg
+    assert c.frames == 1
+    assert c.bytes_in == len(msg)
+    assert c.bytes_out == len(z)
+
+
+def test_small():
+    c = FrameCompressor("deflate", min_size=128)
+    msg = packer(["info", dict(text="hi")])
+    assert c.compress(msg) is msg
+    assert c.frames == 0
+
+
+def test_incompressible():
+    c = FrameCompressor("deflate", min_size=0)
+    msg = packer(["bin", bytes(range(256))])
+    assert c.compress(msg) is msg
+
+
+def test_setup_msg():
+    zdict = train_dictionary(SAMPLES)
+    assert FrameCompressor("deflate", zdict).setup_msg() is None
+
+    c = FrameCompressor("dict", zdict)
+    action, data = unpacker(c.setup_msg())
+    assert action == "zdict"
+    assert data == zdict
+
+
+def test_dictionary():
+    zdict = train_dictionary(SAMPLES + [HTML]*5, size=1024)
+    assert len(zdict) <= 1024
+    assert b'<button type="button" class="btn btn-primary">' in zdict
+
+    # Remi's numeric IDs are useless in a dictionary
+    zdict = train_dictionary(['<td id="140432431037200">'])
+    assert b"140432431037200" not in zdict
+
+
+def test_mode():
+    with pytest.raises(ValueError):
+        FrameCompressor("brotli")
@@ -0,0 +1,111 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+from deframed.worker import run_ordered
+
+
+@pytest.mark.trio
+async def test_run_ordered(autojump_clock):
+    done = []
+    running = 0
+    most = 0
+
+    async def proc(item):
+        nonlocal running, most
+        k, i, t = item
+        running += 1
+        most = max(most, running)
+        await trio.sleep(t)
+        running -= 1
+        done.append((k, i))
+
+    s, r = trio.open_memory_channel(10)
+    for item in [("a",1,3), ("a",2,1), ("b",1,1), ("c",1,1), ("b",2,1)]:
+        s.send_nowait(item)
+    s.close()
+    await run_ordered(r, proc, lambda item: item[0], 2)
+
+    assert most == 2
+    assert [i for k,i in done if k == "a"] == [1, 2]
+    assert [i for k,i in done if k == "b"] == [1, 2]
+    # "a" was slow, the others didn't wait for it
+    assert done.index(("c",1)) < done.index(("a",1))
+
+
+@pytest.mark.trio
+async def test_run_ordered_limit():
+    s, r = trio.open_memory_channel(10)
+    go = trio.Event()
+
+    async def proc(item):
+        await go.wait()
+
+    async with trio.open_nursery() as n:
+        n.start_soon(run_ordered, r, proc, lambda item: item, 5, 2)
+        for i in range(4):
+            s.send_nowait(i)
+        await wait_all_tasks_blocked()
+        # two are running, the others wait in the channel
+        assert r.statistics().current_buffer_used == 2
+        go.set()
+        s.close()
+
+
+class W(Worker):
+    title = "test"
+    concurrency = 3
+
+    def __init__(self, *a, **k):
+        super().__init__(*a, **k)
+        self.log = []
+        self.go = trio.Event()
+
+    async def form_slow(self, n):
+        await self.go.wait()
+        self.log.append(("slow", n))
+
+    async def button_a(self):
+        self.log.append("a")
+
+    async def msg_ask(self, data):
+        self.log.append(await self.request("eval", data))
+
+
+@pytest.mark.trio
+async def test_concurrent(app, connect):
+    w, ws = await connect(app(W))
+    await ws.put("form", ["slow", dict(n=1)])
+    await ws.put("form", ["slow", dict(n=2)])
+    await ws.put("button", "a")
+    # the slow form doesn't hold up the button
+    assert w.log == ["a"]
+
+    w.go.set()
+    await wait_all_tasks_blocked()
+    assert w.log == ["a", ("slow", 1), ("slow", 2)]
+
+
+@pytest.mark.trio
+async def test_request(app, connect):
+    # Handlers may wait for the client.
+    w, ws = await connect(app(W))
+    await ws.put("ask", dict(obj="x"))
+    action, (req, n, data) = ws.messages()[-1]
+    assert action == "req"
+    await ws.put("reply", [n, 42])
+    assert w.log == [42]
+
+
+@pytest.mark.trio
+async def test_sequential(app, connect):
+    class S(W):
+        concurrency = 1
+    w, ws = await connect(app(S))
+    await ws.put("form", ["slow", dict(n=1)])
+    await ws.put("button", "a")
+    assert w.log == []
+    w.go.set()
+    await wait_all_tasks_blocked()
+    assert w.log == [("slow", 1), "a"]
@@ -0,0 +1,132 @@
+import pytest
+
+from deframed.diff import parse, serialize, diff, Elem, Comment
+
+
+def apply(nodes, ops):
+    """
+    Apply patches to a parsed tree, like the client does to the DOM.
+    """
+    root = Elem(None, {})
+    root.children = parse(serialize(nodes))
+
+    def walk(path, tag=None):
+        n = root
+        for i in path:
+            n = n.children[i]
+        name = n.tag if type(n) is Elem else "#comment" if type(n) is Comment else "#text"
+        if tag is not None and n is not root and name != tag:
+            raise ValueError("bad tag", name, tag)
+        return n
+
+    for op in ops:
+        if op[0] == "t":
+            p, i = walk(op[1][:-1]), op[1][-1]
+            p.children[i] = op[2]
+        elif op[0] == "a":
+            n = walk(op[1], op[2])
+            for k,v in op[3].items():
+                if v is None:
+                    del n.attrs[k]
+                else:
+                    n.attrs[k] = v
+        elif op[0] == "r":
+            walk(op[1], op[2])
+            p, i = walk(op[1][:-1]), op[1][-1]
+            p.children[i:i+1] = parse(op[3])
+        elif op[0] == "i":
+            n = walk(op[1], op[2])
+            n.children[op[3]:op[3]] = parse(op[4])
+        elif op[0] == "d":
+            n = walk(op[1], op[2])
+            del n.children[op[3]:op[3]+op[4]]
+        else:
+            raise ValueError(op)
+    return serialize(root.children)
+
+
+CASES = [
+    ("<p>a</p>", "<p>b</p>"),
+    ('<p class="x">a</p>', '<p class="y" id="q">a</p>'),
+    ('<p class="x" id="q">a</p>', '<p class="x">a</p>'),
+    ("<ul><li>1</li><li>2</li></ul>", "<ul><li>1</li><li>new</li><li>2</li></ul>"),
+    ("<ul><li>1</li><li>2</li><li>3</li></ul>", "<ul><li>1</li><li>3</li></ul>"),
+    ("<div><p>x</p></div>", "<div><span>x</span></div>"),
+    ("<div>text</div>", "<div><b>text</b></div>"),
+    ("<div><!--c-->x</div>", "<div><!--d-->x</div>"),
+    ("<div>a<br>b</div>", "<div>a<br>c</div>"),
+    ("<table><tr><td>1</td></tr></table>", "<table><tr><td>2</td></tr></table>"),
+    ("<script>if (a<b) x();</script>", "<script>if (a>b) x();</script>"),
+]
+
+
+@pytest.mark.parametrize("old,new", CASES)
+def test_apply(old, new):
+    o, n = parse(old), parse(new)
+    ops = diff(o, n)
+    assert apply(o, ops) == serialize(n)
+
+
+@pytest.mark.parametrize("old,new", CASES)
+def test_apply_elem(old, new):
+    o, n = parse(old), parse(new)
+    ops = diff(o, n, elem=True)
+    assert apply(o, ops) == serialize(n)
+
+
+def test_same():
+    assert diff(parse("<p>a</p>"), parse("<p>a</p>")) == []
+
+
+def test_elem():
+    assert diff(parse("<p>a</p><p>b</p>"), parse("<p>a</p>"), elem=True) is None
+    assert diff(parse("text"), parse("<p>a</p>"), elem=True) is None
+
+
+def test_ops():
+    assert diff(parse("<p>a</p>"), parse("<p>b</p>")) == [["t", [0,0], "b"]]
+    assert diff(parse('<p class="x">a</p>'), parse('<p>a</p>')) == \
+        [["a", [0], "p", {"class": None}]]
+    assert diff(parse("<div><p>x</p></div>"), parse("<div><i>x</i></div>")) == \
+        [["r", [0,0], "p", "<i>x</i>"]]
+    assert diff(parse("<div>x</div>"), parse("<div><i>x</i></div>")) == \
+        [["r", [0,0], "#text", "<i>x</i>"]]
+    assert diff(parse("<ul><li>1</li></ul>"), parse("<ul><li>1</li><li>2</li></ul>")) == \
+        [["i", [0], "ul", 1, "<li>2</li>"]]
+    assert diff(parse("<ul><li>1</li><li>2</li></ul>"), parse("<ul><li>2</li></ul>")) == \
+        [["d", [0], "ul", 0, 1]]
+
+
+def test_roundtrip():
+    html = '<div id="a" class="b &amp; c">x &lt; y<br><input type="text" value="&quot;"><!-- c --></div>'
+    assert serialize(parse(html)) == html
+
+
+def test_tbody():
+    # The browser inserts tbody; paths must count it.
+    nodes = parse("<table><tr><td>1</td></tr></table>")
+    t = nodes[0]
+    assert t.tag == "table"
+    assert [c.tag for c in t.children] == ["tbody"]
+    assert t.children[0].children[0].tag == "tr"
+
+    ops = diff(parse("<table><tr><td>1</td><td>2</td></tr></table>"),
+        parse("<table><tr><td>1</td><td><b>2</b></td></tr></table>"))
+    assert ops == [["r", [0,0,0,1,0], "#text", "<b>2</b>"]]
+
+
+def test_implicit():
+    t = parse("<table><thead><tr><th>h</th></tr></thead><tr><td>1</td></tr></table>")[0]
+    assert [c.tag for c in t.children] == ["thead", "tbody"]
+
+    t = parse("<table><td>1</td></table>")[0]
+    assert t.children[0].tag == "tbody"
+    assert t.children[0].children[0].tag == "tr"
+    assert t.children[0].children[0].children[0].tag == "td"
+
+    t = parse("<table><col><col><tr><td>1</td></tr></table>")[0]
+    assert [c.tag for c in t.children] == ["colgroup", "tbody"]
+    assert len(t.children[0].children) == 2
+
+    # no table: nothing to add
+    assert parse("<tr><td>1</td></tr>")[0].tag == "tr"
@@ -0,0 +1,63 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+
+
+class W(Worker):
+    title = "test"
+    go = None
+
+    async def msg_wait(self, data):
+        await self.go.wait()
+
+    async def msg_big(self, n):
+        await self.send("info", text=str(n)*1000)
+
+
+def cfg(**ws):
+    return dict(ws=dict(dict(window=1500, queue_len=1, in_queue_len=2), **ws))
+
+
+@pytest.mark.trio
+async def test_window(app, connect):
+    w, ws = await connect(app(W, **cfg()))
+    await ws.ack(w)
+    for i in range(3):
+        await w.send("info", text=str(i)*1000)
+    # the third doesn't fit into the window
+    await wait_all_tasks_blocked()
+    assert len(ws.messages("info")) == 2
+    assert w._talker.stats()["unacked"] > 1500
+
+    await ws.ack(w)
+    assert len(ws.messages("info")) == 3
+
+
+@pytest.mark.trio
+async def test_read_acks(app, connect):
+    # The handler waits for room in the send queue, which waits for an
+    # ack, which is behind more messages than the incoming queue holds.
+    # This must not deadlock.
+    w, ws = await connect(app(W, **cfg()))
+    await ws.ack(w)
+    for i in range(6):
+        await ws.put("big", i)
+    for _ in range(10):
+        await ws.ack(w)
+    assert [m["text"][0] for m in ws.messages("info")] == list("012345")
+
+
+@pytest.mark.trio
+async def test_in_queue(app, connect):
+    # Without a stall, the reader waits for the worker.
+    w, ws = await connect(app(W, **cfg(window=0)))
+    w.go = trio.Event()
+    for i in range(5):
+        await ws.put("wait", i)
+    t = w._talker
+    assert len(t._in) == t.in_queue_len
+    w.go.set()
+    await wait_all_tasks_blocked()
+    assert not t._in
@@ -0,0 +1,78 @@
+import pytest
+
+from deframed import Worker, on_msg, on_button, on_form
+
+
+class W(Worker):
+    title = "test"
+    got = None
+
+    async def msg_plain(self, data):
+        self.got = ("plain", data)
+
+    @on_msg("hello")
+    async def greet(self, data):
+        self.got = ("greet", data)
+
+    @on_button("ok")
+    async def pressed(self):
+        self.got = ("ok",)
+
+    @on_form("login")
+    async def login(self, user):
+        self.got = ("login", user)
+
+    @on_msg("static")
+    @staticmethod
+    async def static(data):
+        W.got = ("static", data)
+
+    @on_msg("cls")
+    @classmethod
+    async def klass(cls, data):
+        cls.got = ("cls", cls.__name__, data)
+
+
+class S(W):
+    async def greet(self, data):
+        self.got = ("sub", data)
+
+
+def test_names():
+    assert W.handlers() == S.handlers()
+    h = W.handlers()
+    assert {"plain", "hello", "static", "cls", "button", "form"} <= set(h["msg"])
+    assert "greet" not in h["msg"]
+    assert h["button"] == ["ok"]
+    assert h["form"] == ["login"]
+
+
+@pytest.mark.trio
+async def test_dispatch(app, connect):
+    w, ws = await connect(app(W))
+    await ws.put("plain", 1)
+    assert w.got == ("plain", 1)
+    await ws.put("hello", 2)
+    assert w.got == ("greet", 2)
+    await ws.put("button", "ok")
+    assert w.got == ("ok",)
+    await ws.put("form", ["login", dict(user="me")])
+    assert w.got == ("login", "me")
+
+
+@pytest.mark.trio
+async def test_static(app, connect):
+    w, ws = await connect(app(W))
+    await ws.put("static", 3)
+    assert W.got == ("static", 3)
+    await ws.put("cls", 4)
+    assert W.got == ("cls", "W", 4)
+    W.got = None
+
+
+@pytest.mark.trio
+async def test_override(app, connect):
+    # The subclass doesn't repeat the declaration.
+    w, ws = await connect(app(S))
+    await ws.put("hello", 5)
+    assert w.got == ("sub", 5)
@@ -0,0 +1,57 @@
+import pytest
+from trio.testing import wait_all_tasks_blocked
+
+import deframed.worker
+from deframed import Worker, PackedMessage
+from deframed.util import packer
+
+NAV = PackedMessage("set", ["nav", "<ul></ul>", None])
+
+
+class W(Worker):
+    title = "test"
+
+
+def test_lazy(monkeypatch):
+    calls = []
+
+    def counted(data):
+        calls.append(data)
+        return packer(data)
+
+    monkeypatch.setattr(deframed.worker, "packer", counted)
+    m = PackedMessage("info", dict(level="info"), text="hi")
+    assert not calls
+    assert m.msg == packer(["info", dict(level="info", text="hi")])
+    assert m.msg is m.msg
+    assert len(calls) == 1
+    assert m[0] == "info"
+
+
+def test_no_request():
+    with pytest.raises(RuntimeError):
+        PackedMessage("req", ["eval", 1, None])
+
+
+@pytest.mark.trio
+async def test_send(app, connect):
+    w, ws = await connect(app(W))
+    await w.send(NAV)
+    await w.send(NAV)
+    await wait_all_tasks_blocked()
+    assert ws.messages("set") == [["nav", "<ul></ul>", None]]*2
+
+    with pytest.raises(TypeError):
+        await w.send(NAV, text="more")
+
+
+@pytest.mark.trio
+async def test_batch(app, connect):
+    w, ws = await connect(app(W))
+    n = len(ws.frames)
+    async with w.batch():
+        await w.send("info", text="one")
+        await w.send(NAV)
+    await wait_all_tasks_blocked()
+    assert len(ws.frames) == n+1
+    assert ws.frames[-1] == ["batch", [["info", dict(text="one")], ["set", ["nav", "<ul></ul>", None]]]]
@@ -0,0 +1,136 @@
+import gc
+
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+import deframed.remi.gui as gui
+from deframed import Worker
+from deframed.remi import RemiHandler, RemiSupport
+from deframed.remi.server import Widgets, runtimeInstances
+
+
+class H(RemiHandler):
+    def main(self):
+        self.label = gui.Label("hello")
+        self.button = gui.Button("go")
+        self.button.onclick.do(self.on_go)
+        box = gui.Container(children=[self.label, self.button])
+        return box
+
+    def on_go(self, widget):
+        self.label.set_text("clicked")
+
+
+class W(RemiSupport, Worker):
+    title = "test"
+    handler = H
+
+    async def show_main(self, token=None):
+        self.h = self.handler(self)
+        await self.h.show()
+        await super().show_main(token)
+
+
+async def shown(a, connect):
+    """
+    Start a session of this app that shows its Remi GUI.
+    """
+    w, ws = await connect(a)
+    for action, (req, n, data) in [m for m in ws.messages() if m[0] == "req"]:
+        assert req == "query"
+        info = dict(box={}, scroll=dict(width=100, height=100))
+        await ws.put("reply", [n, dict(ids=[info], sel=[])])
+    await wait_all_tasks_blocked()
+    return w, ws
+
+
+def updates(ws):
+    """
+    Returns the ``elems`` changes the client got, by element ID.
+    """
+    res = {}
+    for changes in ws.messages("elems"):
+        for id, *change in changes:
+            res.setdefault(id, []).append(change)
+    return res
+
+
+@pytest.mark.trio
+async def test_event(app, connect):
+    w, ws = await shown(app(W), connect)
+    h = w.h
+    await ws.put("remi_event", [h.button.identifier, "onclick", {}])
+    assert h.label.get_text() == "clicked"
+    # only the text is sent
+    assert updates(ws)[h.label.identifier] == [[{}, {}, "clicked"]]
+
+
+@pytest.mark.trio
+async def test_long_callback(app, connect, autojump_clock):
+    # Changes made by a callback that takes a while are sent before
+    # it's done.
+    go = trio.Event()
+
+    class HS(H):
+        async def on_go(self, widget):
+            self.label.set_text("working")
+            await go.wait()
+            self.label.set_text("done")
+
+    class WS(W):
+        handler = HS
+
+    w, ws = await shown(app(WS), connect)
+    h = w.h
+    await ws.put("remi_event", [h.button.identifier, "onclick", {}])
+    assert h._hold
+    await trio.sleep(h.hold_max*2)
+    assert h._hold
+    assert len(updates(ws).get(h.label.identifier, ())) == 1
+
+    go.set()
+    await wait_all_tasks_blocked()
+    assert not h._hold
+    assert len(updates(ws)[h.label.identifier]) == 2
+
+
+def test_registry():
+    reg = Widgets()
+    with reg.active():
+        label = gui.Label("x")
+    assert label.identifier == "1"
+    assert reg.get("1") is label
+    assert runtimeInstances.get("1") is None
+    assert runtimeInstances.get("1", reg) is label
+
+    # outside of a session
+    other = gui.Label("y")
+    assert other.identifier == str(id(other))
+    assert runtimeInstances.get(other.identifier) is other
+    assert reg.get(other.identifier) is None
+
+    # only weakly referenced
+    del label
+    gc.collect()
+    assert len(reg) == 0
+
+
+@pytest.mark.trio
+async def test_sessions(app, connect, nursery):
+    # Each session has its own widgets, with the same IDs.
+    a = app(W)
+    await nursery.start(a.clients.run)
+    w1, ws1 = await shown(a, connect)
+    w2, ws2 = await shown(a, connect)
+    assert w1.h.button.identifier == w2.h.button.identifier
+
+    await ws2.put("remi_event", [w2.h.button.identifier, "onclick", {}])
+    assert w1.h.label.get_text() == "hello"
+    assert w2.h.label.get_text() == "clicked"
+    assert w1.stats()["widgets"] == w2.stats()["widgets"] > 2
+
+    a.clients.evict(w1, "test")
+    await wait_all_tasks_blocked()
+    assert w1.stats()["widgets"] == 0
+    assert w2.stats()["widgets"] > 2
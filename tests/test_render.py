@@ -0,0 +1,149 @@
+import deframed.remi.gui as gui
+from deframed.remi import render
+
+
+class Top:
+    """
+    What a GUI is attached to, like `deframed.remi._Remi`.
+    """
+    def __init__(self, root):
+        self._dirty = set()
+        self.updates = 0
+        root._parent = self
+        self.gui = root
+
+    def _need_update(self, *a, **k):
+        self.updates += 1
+
+
+def tree(n=10):
+    labels = [gui.Label(str(i)) for i in range(n)]
+    box = gui.Container(children=labels)
+    return Top(box), box, labels
+
+
+def test_dirty():
+    top, box, labels = tree()
+    render.html(box)
+    assert not top._dirty
+
+    labels[3].set_text("x")
+    labels[5].style["color"] = "red"
+    assert top._dirty == {labels[3], labels[5]}
+    assert top.updates
+
+    changed = render.changed(box, top._dirty)
+    assert set(changed) == {labels[3], labels[5]}
+    assert not top._dirty
+    assert render.changed(box, top._dirty) == {}
+
+
+def test_cached(monkeypatch):
+    # Re-rendering a parent doesn't render its unchanged children again.
+    top, box, labels = tree()
+    render.html(box)
+    rendered = []
+    html = render.html
+
+    def counted(w):
+        rendered.append(w)
+        return html(w)
+
+    monkeypatch.setattr(render, "html", counted)
+    labels[2].set_text("x")
+    box.style["color"] = "red"
+    res = render.html(box)
+    assert '>x<' in res
+    assert rendered == [box, *labels]
+    # … but they return their cached HTML
+    assert all(w._backup_repr for w in labels)
+    assert not any(w._ischanged() for w in labels)
+
+    rendered.clear()
+    assert render.html(box) == res
+    assert rendered == [box]
+
+
+def test_removed():
+    # A widget that's no longer in the tree is not sent.
+    top, box, labels = tree(3)
+    render.html(box)
+    old = labels[1]
+    old.set_text("gone")
+    box.remove_child(old)
+    old.set_text("really")
+    changed = render.changed(box, top._dirty)
+    assert old not in changed
+    assert box in changed
+
+
+def test_parent_first():
+    # A child that changed along with its parent is part of the parent's
+    # HTML.
+    top, box, labels = tree(3)
+    render.html(box)
+    labels[0].set_text("a")
+    box.append(gui.Label("new"))
+    changed = render.changed(box, top._dirty)
+    assert list(changed) == [box]
+    assert ">a<" in changed[box]
+
+
+def test_patch_style():
+    top, box, labels = tree(3)
+    render.html(box)
+    labels[1].style["background-image"] = "url(x.png)"
+    labels[1].attributes["title"] = "hi"
+    changed = render.changed(box, top._dirty)
+    assert changed == {labels[1]: ({"title": "hi"}, {"background-image": "url(x.png)"}, None)}
+
+    # nothing changed since
+    assert render._patch(labels[1]) == ({}, {}, None)
+
+
+def test_patch_remove():
+    top, box, labels = tree(3)
+    labels[1].style["color"] = "red"
+    labels[1].attributes["title"] = "hi"
+    render.html(box)
+    del labels[1].style["color"]
+    del labels[1].attributes["title"]
+    labels[1]._need_update(labels[1])
+    changed = render.changed(box, top._dirty)
+    assert changed == {labels[1]: ({"title": None}, {"color": None}, None)}
+
+
+def test_patch_text():
+    top, box, labels = tree(3)
+    render.html(box)
+    labels[2].set_text("new")
+    changed = render.changed(box, top._dirty)
+    assert changed == {labels[2]: ({}, {}, "new")}
+
+
+def test_patch_children():
+    # New children: the element is replaced.
+    top, box, labels = tree(3)
+    render.html(box)
+    box.append(gui.Label("more"))
+    changed = render.changed(box, top._dirty)
+    assert isinstance(changed[box], str)
+    assert ">more<" in changed[box]
+
+
+def test_patch_textarea():
+    # The browser ignores a textarea's changed content.
+    area = gui.TextInput(single_line=False)
+    top = Top(gui.Container(children=[area]))
+    render.html(top.gui)
+    area.set_text("new")
+    changed = render.changed(top.gui, top._dirty)
+    assert isinstance(changed[area], str)
+
+
+def test_patch_unchanged():
+    # Setting the same value again doesn't send anything.
+    top, box, labels = tree(3)
+    render.html(box)
+    labels[0].set_text("0")
+    assert render.changed(box, top._dirty) == {}
@@ -0,0 +1,101 @@
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+
+
+class W(Worker):
+    title = "test"
+    shown = 0
+
+    async def show_main(self, token=None):
+        W.shown += 1
+        await super().show_main(token)
+
+
+@pytest.fixture
+def a(app):
+    W.shown = 0
+    return app(W)
+
+
+@pytest.mark.trio
+async def test_resume(a, connect):
+    w, ws = await connect(a)
+    for i in range(3):
+        await w.set_content("x", str(i))
+        await wait_all_tasks_blocked() # one frame each
+    n = len(ws.frames)
+    await ws.close()
+
+    # the client missed the last two frames
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=n-2)
+    assert w2 is w
+    assert W.shown == 1
+    assert ws2.messages("set") == [["x", "1", None], ["x", "2", None]]
+    assert w.stats()["seq"] == n-2+len(ws2.frames)
+
+
+@pytest.mark.trio
+async def test_resume_gone(a, connect):
+    w, ws = await connect(a)
+    await wait_all_tasks_blocked()
+    n = len(ws.frames)
+    await ws.close()
+    # the client says it got more than we sent
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=n+1)
+    assert w2 is w
+    assert W.shown == 2
+
+
+@pytest.mark.trio
+async def test_detached(a, connect):
+    # Messages sent while the client is away are delivered when it's back.
+    w, ws = await connect(a)
+    await wait_all_tasks_blocked()
+    n = len(ws.frames)
+    await ws.close()
+    await w.set_content("x", "away")
+    assert a.clients.stats()["detached"] == 1
+
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=n)
+    assert W.shown == 1
+    assert ws2.messages("set") == [["x", "away", None]]
+    assert a.clients.stats()["detached"] == 0
+
+
+@pytest.mark.trio
+async def test_detached_lost(app, connect):
+    # If messages had to be dropped, the client is rebuilt.
+    class D(W):
+        overflow = "disconnect"
+    W.shown = 0
+    a = app(D, ws=dict(queue_len=2))
+    w, ws = await connect(a)
+    await wait_all_tasks_blocked()
+    n = len(ws.frames)
+    await ws.close()
+    for i in range(4):
+        await w.set_content("x%d" % i, "away")
+    assert w._talker.lost == 2
+
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=n)
+    assert W.shown == 2
+    # nothing queued while away is sent to the rebuilt client
+    assert not [m for m in ws2.messages("set") if m[0].startswith("x")]
+
+
+@pytest.mark.trio
+async def test_died(a, connect):
+    # The final message is counted like any other frame.
+    w, ws = await connect(a)
+    await w._talker.died("oops")
+    assert ws.messages("info")[-1]["text"] == "oops"
+    assert w.stats()["seq"] == len(ws.frames)
+    await ws.close()
+
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=len(ws.frames))
+    assert w2 is w
+    assert W.shown == 1
+    assert ws2.frames == []
@@ -0,0 +1,119 @@
+import os
+import time
+from types import SimpleNamespace
+from uuid import UUID, uuid1
+
+import pytest
+import trio
+from trio.testing import memory_stream_pair
+
+from deframed import Worker
+from deframed.runner import Runner, process_of, relay, serve_relayed, send_frame, receive_frame
+
+from conftest import FakeSocket
+
+
+class W(Worker):
+    title = "test"
+
+
+def test_process_of():
+    u = str(uuid1(3))
+    assert process_of(u, 4) == 3
+    assert process_of(u, 3) is None
+    assert process_of(None, 4) is None
+    assert process_of("", 4) is None
+    assert process_of("not-a-uuid", 4) is None
+
+
+@pytest.mark.trio
+async def test_frames():
+    a, b = memory_stream_pair()
+    await send_frame(a, b"\x01\x02")
+    await send_frame(a, "text")
+    await a.aclose()
+    buf = bytearray()
+    assert await receive_frame(b, buf) == b"\x01\x02"
+    assert await receive_frame(b, buf) == "text"
+    assert await receive_frame(b, buf) is None
+
+
+async def wait_for(proc):
+    with trio.fail_after(5):
+        while not proc():
+            await trio.sleep(0.01)
+
+
+@pytest.mark.trio
+async def test_relay(app, nursery, tmp_path):
+    a = app(W)
+    path = str(tmp_path / "0.sock")
+    await nursery.start(serve_relayed, a, path)
+
+    assert not await relay(FakeSocket(), str(tmp_path / "1.sock"))
+
+    ws = FakeSocket()
+    ws.headers = {"User-Agent": "test"}
+    done = trio.Event()
+
+    async def run():
+        try:
+            await relay(ws, path)
+        except BaseException as exc:
+            if isinstance(exc, trio.Cancelled):
+                raise
+        done.set()
+
+    nursery.start_soon(run)
+    await ws.put("setup", dict(seq=0))
+    await wait_for(lambda: ws.messages("setup"))
+
+    uuid = UUID(ws.messages("setup")[0]["uuid"])
+    w = a.clients[uuid]
+    assert w._talker.ws.headers == {"User-Agent": "test"}
+    assert a.clients.stats()["live"] == 1
+
+    # the client goes away
+    await ws.close()
+    await wait_for(done.is_set)
+    await wait_for(lambda: a.clients.stats()["detached"] == 1)
+
+
+class QuickRunner(Runner):
+    """
+    Its processes exit right away, some of them after a while.
+    """
+    def __init__(self, app, lifetime):
+        super().__init__(app)
+        self.lifetime = lifetime
+        self.starts = [0]*self.processes
+
+    def _start(self, i):
+        self.starts[i] += 1
+        if self.starts[1] > 3:
+            self._stop()
+            return
+        pid = os.fork()
+        if not pid:
+            time.sleep(self.lifetime[i])
+            os._exit(1)
+        self._pids[pid] = i
+        self._started[i] = time.monotonic()
+
+
+def test_restart():
+    app = SimpleNamespace(cfg=SimpleNamespace(runner=SimpleNamespace(
+        processes=2, socket_dir=None, restart_delay=0.05)))
+    r = QuickRunner(app, [0, 0.1])
+    r._delay[0] = 100 # process 0 keeps crashing: wait a long time
+
+    t = time.monotonic()
+    for i in range(r.processes):
+        r._start(i)
+    r._supervise()
+
+    # waiting for process 0 doesn't hold up restarting process 1
+    assert time.monotonic()-t < 5
+    assert r.starts == [1, 4]
+    assert r.restarts == 3
+    assert not r._pids
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+import trio
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+from deframed.util import attrdict
+from deframed.session import Sessions
+
+
+class FakeWorker:
+    _talker = None
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.cancelled = False
+
+    def leave(self):
+        pass
+
+    def cancel(self):
+        self.cancelled = True
+
+    def memory(self):
+        return 1000
+
+
+def sessions(**kw):
+    cfg = attrdict(grace=60, idle=0, max_sessions=0, max_bytes=0, sweep=5)
+    cfg.update(kw)
+    return Sessions(cfg)
+
+
+def test_idle_default():
+    s = sessions()
+    s["a"] = FakeWorker("a")
+    s.expire(time.monotonic()+100000)
+    assert "a" in s
+
+
+def test_idle():
+    s = sessions(idle=100)
+    s["a"] = FakeWorker("a")
+    s["b"] = FakeWorker("b")
+    s.expire(time.monotonic()+50)
+    assert len(s) == 2
+
+    s.touch("a")
+    s._active["b"] -= 200
+    s.expire()
+    assert "a" in s
+    assert "b" not in s
+    assert s.stats()["evicted"] == {"idle": 1}
+
+
+def test_grace():
+    s = sessions(grace=10)
+    a = FakeWorker("a")
+    s["a"] = a
+    s.detach(a)
+    assert s.stats()["detached"] == 1
+    s.expire(time.monotonic()+5)
+    assert "a" in s
+    s.expire(time.monotonic()+20)
+    assert "a" not in s
+    assert a.cancelled
+
+
+def test_lru():
+    s = sessions(max_sessions=2)
+    for u in "abc":
+        s[u] = FakeWorker(u)
+        if u == "b":
+            s.touch("a")
+    assert list(s) == ["a", "c"]
+    assert s.stats()["evicted"] == {"count": 1}
+
+
+class W(Worker):
+    title = "test"
+
+    async def evicted(self, reason):
+        self.reason = reason
+        await super().evicted(reason)
+
+
+@pytest.fixture
+async def sessions_app(app, nursery):
+    async def make(**cfg):
+        a = app(W, session=cfg)
+        await nursery.start(a.clients.run)
+        return a
+    return make
+
+
+@pytest.mark.trio
+async def test_worker_grace(sessions_app, connect):
+    a = await sessions_app(grace=10)
+    w, ws = await connect(a)
+    assert a.clients.stats()["live"] == 1
+    await ws.close()
+    assert a.clients.stats()["detached"] == 1
+
+    a.clients.expire(time.monotonic()+5)
+    assert w.uuid in a.clients
+    a.clients.expire(time.monotonic()+20)
+    await wait_all_tasks_blocked()
+    assert w.uuid not in a.clients
+    assert w.reason == "grace"
+    assert a.clients.stats() == dict(live=0, detached=0, evicted={"grace": 1})
+
+    # the client comes back too late, and gets a new session
+    w2, ws2 = await connect(a, uuid=w.uuid, seq=len(ws.frames))
+    assert w2 is not w
+
+
+@pytest.mark.trio
+async def test_worker_count(sessions_app, connect):
+    a = await sessions_app(max_sessions=2)
+    s = [await connect(a) for _ in range(3)]
+    await wait_all_tasks_blocked()
+    (w1, ws1), (w2, ws2), (w3, ws3) = s
+    assert list(a.clients) == [w2.uuid, w3.uuid]
+    assert w1.reason == "count"
+
+
+@pytest.mark.trio
+async def test_worker_memory(sessions_app, connect):
+    # A client that doesn't take anything uses up memory.
+    a = await sessions_app(max_bytes=5000)
+    w1, ws1 = await connect(a)
+    w2, ws2 = await connect(a)
+    ws1.blocked = trio.Event()
+    for i in range(5):
+        await w1.send("info", text=str(i)*1000)
+    a.clients.expire()
+    await wait_all_tasks_blocked()
+    assert list(a.clients) == [w2.uuid]
+    assert w1.reason == "memory"
@@ -0,0 +1,82 @@
+import logging
+import random
+
+import pytest
+from trio.testing import wait_all_tasks_blocked
+
+from deframed import Worker
+from deframed.default import CFG
+from deframed.trace import WireTrace, LazyFormat
+from deframed.util import attrdict
+
+
+class W(Worker):
+    title = "test"
+
+
+class Loud:
+    formatted = 0
+
+    def __repr__(self):
+        Loud.formatted += 1
+        return "loud"
+
+
+def test_ring():
+    t = WireTrace(3)
+    for i in range(5):
+        t.add("out", "set", i)
+    assert len(t) == 3
+    assert [size for _,_,_,size in t.buf] == [2, 3, 4]
+    lines = t.dump().split("\n")
+    assert len(lines) == 3
+    assert lines[0].split()[1:] == ["out", "2", "set"]
+
+
+def test_sampled(monkeypatch):
+    def cfg(**kw):
+        return attrdict(CFG.trace, **kw)
+
+    assert WireTrace.sampled(cfg(sample=0)) is None
+    assert isinstance(WireTrace.sampled(cfg(sample=1)), WireTrace)
+    assert WireTrace.sampled(cfg(size=0, sample=1)) is None
+
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    assert WireTrace.sampled(cfg(sample=0.4)) is None
+    assert WireTrace.sampled(cfg(sample=0.6)) is not None
+
+
+def test_lazy(caplog):
+    Loud.formatted = 0
+    log = logging.getLogger("deframed.test")
+    with caplog.at_level(logging.INFO, "deframed.test"):
+        log.debug("%s", LazyFormat([Loud()]))
+        assert Loud.formatted == 0
+        log.info("%s", LazyFormat([Loud()]))
+        assert Loud.formatted
+    assert caplog.records[-1].getMessage() == "[loud]"
+
+
+@pytest.mark.trio
+async def test_session(app, connect):
+    w, ws = await connect(app(W))
+    assert w.trace is None # not sampled by default
+    w.start_trace(10)
+    await w.send("info", text="hello")
+    await ws.put("pong", None)
+    await wait_all_tasks_blocked()
+
+    entries = [(d, a) for _,d,a,_ in w.trace.buf]
+    assert ("out", "info") in entries
+    assert ("in", "pong") in entries
+    assert w._talker.trace is w.trace
+
+
+@pytest.mark.trio
+async def test_sampled_session(app, connect):
+    w, ws = await connect(app(W, trace=dict(sample=1, size=5)))
+    assert w.trace is not None
+    for i in range(10):
+        await w.send("info", text=str(i))
+        await wait_all_tasks_blocked() # one frame each
+    assert len(w.trace) == 5